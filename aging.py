@@ -0,0 +1,96 @@
+\
+from db import get_conn, fetchall, fetchall_report, AGING_BUCKET_SQL
+
+BUCKETS = {0: "0–30 dias", 1: "31–60 dias", 2: "61–90 dias", 3: "90+ dias"}
+
+def _fetch(sql, params, store_ids):
+    if store_ids is None:
+        return fetchall(sql, params)
+    return fetchall_report(sql, params, store_ids)
+
+def roll_forward(store_id: str = None) -> int:
+    """
+    Move items to their current aging bucket. Cheap no-op after the first call
+    of the day; rebuilds item_aging from scratch the first time it runs.
+    Returns the number of items that changed bucket.
+    """
+    with get_conn(store_id) as conn:
+        today = conn.execute("SELECT date('now')").fetchone()[0]
+        row = conn.execute("SELECT value FROM app_meta WHERE key = 'aging_rolled_on'").fetchone()
+        if row and row[0] == today:
+            return 0
+        if row is None:
+            conn.execute("DELETE FROM item_aging")
+            conn.execute("DELETE FROM aging_summary")
+            cur = conn.execute(f"""
+                INSERT INTO item_aging(sku, category, size, listed_at, markdown_stage, bucket)
+                SELECT sku, COALESCE(category,''), COALESCE(size,''), listed_at,
+                       COALESCE(markdown_stage,0), {AGING_BUCKET_SQL.format(col='listed_at')}
+                FROM items
+                WHERE active = 1 AND sold_at IS NULL
+            """)
+        else:
+            # Only rows past their bucket boundary are touched (range scans on bucket, listed_at)
+            cur = conn.execute(f"""
+                UPDATE item_aging SET bucket = {AGING_BUCKET_SQL.format(col='listed_at')}
+                WHERE (bucket = 0 AND listed_at < datetime('now','-30 days'))
+                   OR (bucket = 1 AND listed_at < datetime('now','-60 days'))
+                   OR (bucket = 2 AND listed_at < datetime('now','-90 days'))
+            """)
+        conn.execute("""
+            INSERT INTO app_meta(key, value) VALUES ('aging_rolled_on', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (today,))
+        return cur.rowcount
+
+def bucket_counts(group_by=("category",), min_bucket=0, max_stage=None, store_ids=None):
+    """Item counts per group and bucket, read from the aging_summary table."""
+    group_cols = ", ".join(group_by)
+    select_cols = f"{group_cols}, " if group_cols else ""
+    sql = f"""
+        SELECT {select_cols}bucket, SUM(qty) AS qty
+        FROM aging_summary
+        WHERE qty > 0 AND bucket >= ?
+    """
+    params = [min_bucket]
+    if max_stage is not None:
+        sql += " AND markdown_stage <= ?"
+        params.append(max_stage)
+    sql += f" GROUP BY {select_cols}bucket ORDER BY {select_cols}bucket"
+    return _fetch(sql, params, store_ids)
+
+def pending_markdowns(store_ids=None):
+    """Items whose markdown stage is behind their aging bucket, per target bucket."""
+    return _fetch("""
+        SELECT bucket, SUM(qty) AS qty
+        FROM aging_summary
+        WHERE qty > 0 AND markdown_stage < bucket
+        GROUP BY bucket
+        ORDER BY bucket DESC
+    """, (), store_ids)
+
+def bucket_skus(bucket: int, category=None, size=None):
+    """SKU list of a bucket, optionally narrowed to a category and/or size."""
+    sql = "SELECT sku FROM item_aging WHERE bucket = ?"
+    params = [bucket]
+    if category is not None:
+        sql += " AND category = ?"
+        params.append(category)
+    if size is not None:
+        sql += " AND size = ?"
+        params.append(size)
+    _, rows = fetchall(sql + " ORDER BY listed_at", params)
+    return [r[0] for r in rows]
+
+def oldest_in_bucket(bucket: int, limit: int = 20):
+    """Top-N oldest items of a bucket, walked in index order (no full-table sort). Undated items are left out."""
+    return fetchall("""
+        SELECT a.sku, i.category, i.brand, i.size,
+               julianday('now') - julianday(a.listed_at) AS days_listed,
+               i.list_price, a.markdown_stage
+        FROM item_aging a
+        JOIN items i ON i.sku = a.sku
+        WHERE a.bucket = ? AND a.listed_at IS NOT NULL
+        ORDER BY a.listed_at ASC
+        LIMIT ?
+    """, (bucket, limit))
@@ -1,6 +1,7 @@
 \
 import streamlit as st
-from db import init_db
+from db import init_db, load_stores, current_store, register_store
+from manifest import migrate_legacy
 
 st.set_page_config(page_title="Brechó Local", layout="wide")
 st.title("Brechó — Sistema Local (SQLite)")
@@ -23,9 +24,35 @@ st.markdown(
 )
 
 if "db_ready" not in st.session_state:
-    init_db()
+    for store_id in load_stores():
+        init_db(store_id)
+        # Legacy photos/<SKU>/ folders into the blob store (no-op once migrated)
+        migrate_legacy(store_id)
     st.session_state["db_ready"] = True
 
+# Store selection (used by every page through db.get_conn)
+stores = load_stores()
+store_ids = list(stores)
+selected_store = st.sidebar.selectbox(
+    "Loja:", store_ids, index=store_ids.index(current_store()),
+    format_func=lambda s: f"{stores[s]['name']} ({s})"
+)
+st.session_state["store_id"] = selected_store
+
+with st.sidebar.expander("Cadastrar nova loja"):
+    new_store_id = st.text_input("ID da loja (ex.: loja2)")
+    new_store_name = st.text_input("Nome da loja")
+    if st.button("Adicionar loja"):
+        if new_store_id and new_store_name:
+            try:
+                register_store(new_store_id, new_store_name, f"brecho_{new_store_id}.db")
+                st.success(f"Loja {new_store_name} cadastrada.")
+                st.rerun()
+            except ValueError as e:
+                st.error(str(e))
+        else:
+            st.error("Informe ID e nome da loja.")
+
 st.markdown("---")
 st.markdown("Atalhos rápidos:")
 c1, c2, c3 = st.columns(3)
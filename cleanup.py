@@ -0,0 +1,237 @@
+\
+"""
+Nightly photo cleanup, in small resumable steps.
+
+1. links: photo sets of SKUs that are orphaned (no item), or sold or
+   deactivated more than SOLD_RETENTION_DAYS ago, are unlinked (kept in
+   photo_quarantine with their perceptual hashes, for duplicate search)
+2. files: blob files no store references anymore are moved to photos/quarantine/<date>/
+3. purge: quarantine folders older than QUARANTINE_DAYS are deleted
+
+Each step resumes from a cursor in app_meta, so the job can be stopped at any
+point and a run only touches one batch of SKUs / blob folders.
+
+    python cleanup.py [--loja principal] [--dias-vendido 90]
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from db import get_conn, fetchall, fetchall_report, load_stores, STORE_ENV
+from images import BLOBS_DIR, QUARANTINE_DIR, PROFILES, variant_path
+from manifest import insert_blobs, link_photo, unquarantine_blob
+
+SOLD_RETENTION_DAYS = 90
+QUARANTINE_DAYS = 30
+LINK_BATCH = 500            # SKUs unlinked per step
+PREFIX_BATCH = 16           # blob folders (of 256) scanned per step
+# Blob files younger than this are never moved (an upload may still be linking them)
+GC_GRACE_SECONDS = 3600
+
+PREFIXES = [f"{n:02x}" for n in range(256)]
+
+# SKUs with photos after a cursor, with the reason their photos can go
+_CANDIDATES_SQL = """
+    SELECT DISTINCT p.sku,
+           CASE WHEN i.sku IS NULL THEN 'orphaned'
+                WHEN i.sold_at IS NOT NULL THEN 'sold'
+                ELSE 'inactive' END AS reason
+    FROM photos p
+    LEFT JOIN items i ON i.sku = p.sku
+    WHERE p.sku > ?
+      AND (i.sku IS NULL
+           OR (i.sold_at IS NOT NULL AND i.sold_at <= date('now', ?))
+           OR (i.sold_at IS NULL AND i.active = 0 AND i.inactive_since <= datetime('now', ?)))
+"""
+
+def _get_cursor(key: str) -> str:
+    _, rows = fetchall("SELECT value FROM app_meta WHERE key = ?", (key,))
+    return rows[0][0] if rows else ""
+
+def _set_cursor(conn, key: str, value: str):
+    conn.execute("""
+        INSERT INTO app_meta(key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, (key, value))
+
+def _tree_size(path) -> int:
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            total += _tree_size(entry.path) if entry.is_dir() else entry.stat().st_size
+    return total
+
+def pending_cleanup(sold_days: int = SOLD_RETENTION_DAYS) -> dict:
+    """SKUs whose photos the next run would unlink, per reason."""
+    _, rows = fetchall(f"""
+        SELECT reason, COUNT(*) FROM ({_CANDIDATES_SQL}) GROUP BY reason
+    """, ("", f"-{sold_days} days", f"-{sold_days} days"))
+    return dict(rows)
+
+def unlink_step(sold_days: int = SOLD_RETENTION_DAYS, batch: int = LINK_BATCH) -> dict:
+    """Unlink the next batch of SKU photo sets to clean up. Returns {skus, reasons, done}."""
+    cursor = _get_cursor("cleanup_sku_cursor")
+    _, rows = fetchall(f"{_CANDIDATES_SQL} ORDER BY p.sku LIMIT ?", (cursor, f"-{sold_days} days", f"-{sold_days} days", batch))
+    reasons = {}
+    with get_conn() as conn:
+        for sku, reason in rows:
+            conn.execute("""
+                INSERT OR REPLACE INTO photo_quarantine(sku, position, hash, reason, phash)
+                SELECT p.sku, p.position, p.hash, ?, b.phash
+                FROM photos p LEFT JOIN photo_blobs b ON b.hash = p.hash
+                WHERE p.sku = ?
+            """, (reason, sku))
+            conn.execute("DELETE FROM photos WHERE sku = ?", (sku,))
+            reasons[reason] = reasons.get(reason, 0) + 1
+        done = len(rows) < batch
+        # Next night starts over (newly sold items); otherwise continue after the last SKU
+        _set_cursor(conn, "cleanup_sku_cursor", "" if done else rows[-1][0])
+    return {"skus": len(rows), "reasons": reasons, "done": done}
+
+def _move_blob(path: Path, target_root: Path) -> int:
+    """Move a main blob file and its derivatives under target_root. Returns bytes moved."""
+    moved = 0
+    for size in PROFILES:
+        source = variant_path(path, size)
+        try:
+            nbytes = os.stat(source).st_size
+        except FileNotFoundError:
+            continue
+        target = target_root / source.relative_to(BLOBS_DIR)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source, target)
+        moved += nbytes
+    return moved
+
+def quarantine_step(batch: int = PREFIX_BATCH) -> dict:
+    """
+    Move unreferenced blob files of the next batch of blob folders to quarantine.
+    Reference counts are summed over all stores (the blob folder is shared).
+    Returns {blobs, bytes, done}.
+    """
+    cursor = _get_cursor("cleanup_prefix_cursor")
+    prefixes = [p for p in PREFIXES if p > cursor][:batch]
+    store_ids = list(load_stores())
+    target_root = QUARANTINE_DIR / date.today().isoformat()
+    cutoff = time.time() - GC_GRACE_SECONDS
+    removed, moved = [], 0
+    for prefix in prefixes:
+        prefix_dir = BLOBS_DIR / prefix
+        if not prefix_dir.is_dir():
+            continue
+        # PK range scan: only this folder's hashes
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        _, rows = fetchall_report("""
+            SELECT hash FROM photo_blobs WHERE hash >= ? AND hash < ?
+            GROUP BY hash HAVING SUM(refcount) > 0
+        """, (prefix, upper), store_ids)
+        referenced = {r[0] for r in rows}
+        with os.scandir(prefix_dir) as entries:
+            candidates = [entry for entry in entries if entry.is_file()
+                          and Path(entry.name).stem not in referenced
+                          and entry.stat().st_mtime <= cutoff]
+        for entry in candidates:
+            # Re-checked right before moving: an upload re-using the blob touches it
+            try:
+                if os.stat(entry.path).st_mtime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            moved += _move_blob(Path(entry.path), target_root)
+            removed.append((Path(entry.name).stem,))
+    done = not prefixes or prefixes[-1] == PREFIXES[-1]
+    for store_id in store_ids:
+        with get_conn(store_id) as conn:
+            conn.executemany("DELETE FROM photo_blobs WHERE hash = ? AND refcount <= 0", removed)
+    with get_conn() as conn:
+        _set_cursor(conn, "cleanup_prefix_cursor", "" if done else prefixes[-1])
+    return {"blobs": len(removed), "bytes": moved, "done": done}
+
+def purge_quarantine(days: int = QUARANTINE_DAYS) -> dict:
+    """Delete quarantine folders older than `days`. Returns {folders, bytes}."""
+    if not QUARANTINE_DIR.exists():
+        return {"folders": 0, "bytes": 0}
+    limit = (date.today() - timedelta(days=days)).isoformat()
+    purged, freed = 0, 0
+    with os.scandir(QUARANTINE_DIR) as entries:
+        old = [entry.path for entry in entries if entry.is_dir() and entry.name < limit]
+    for path in old:
+        freed += _tree_size(path)
+        shutil.rmtree(path)
+        purged += 1
+    return {"folders": purged, "bytes": freed}
+
+def run_cleanup(sold_days: int = SOLD_RETENTION_DAYS, max_steps: int = None, progress=None) -> dict:
+    """
+    Run unlink and quarantine steps until both reach the end (or max_steps
+    each), then purge old quarantine folders. Returns the summed stats.
+    """
+    stats = {"skus": 0, "reasons": {}, "blobs": 0, "bytes": 0, "purged_bytes": 0, "done": False}
+    steps = 0
+    while max_steps is None or steps < max_steps:
+        result = unlink_step(sold_days)
+        stats["skus"] += result["skus"]
+        for reason, count in result["reasons"].items():
+            stats["reasons"][reason] = stats["reasons"].get(reason, 0) + count
+        steps += 1
+        if result["done"]:
+            break
+    files_done = False
+    steps = 0
+    while max_steps is None or steps < max_steps:
+        result = quarantine_step()
+        stats["blobs"] += result["blobs"]
+        stats["bytes"] += result["bytes"]
+        steps += 1
+        if progress:
+            cursor = _get_cursor("cleanup_prefix_cursor")
+            progress(PREFIXES.index(cursor) + 1 if cursor else len(PREFIXES), len(PREFIXES))
+        if result["done"]:
+            files_done = True
+            break
+    stats["purged_bytes"] = purge_quarantine()["bytes"]
+    stats["done"] = files_done
+    return stats
+
+def restore_sku(sku: str) -> int:
+    """Put a quarantined SKU's photo set back (files included). Returns photos restored."""
+    _, rows = fetchall("SELECT position, hash FROM photo_quarantine WHERE sku = ? ORDER BY position", (sku,))
+    restored = []
+    for position, digest in rows:
+        _, known = fetchall("SELECT 1 FROM photo_blobs WHERE hash = ?", (digest,))
+        if not known:
+            info = unquarantine_blob(digest)
+            if not info:
+                continue
+            with get_conn() as conn:
+                insert_blobs(conn, [(digest, info)])
+        restored.append((position, digest))
+    with get_conn() as conn:
+        for position, digest in restored:
+            link_photo(conn, sku, position, digest)
+        conn.execute("DELETE FROM photo_quarantine WHERE sku = ?", (sku,))
+    return len(restored)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Limpeza noturna de fotos sem uso.")
+    parser.add_argument("--loja", help="ID da loja (padrão: todas)")
+    parser.add_argument("--dias-vendido", type=int, default=SOLD_RETENTION_DAYS,
+                        help="dias após a venda ou inativação para tirar as fotos do item")
+    args = parser.parse_args(argv)
+    store_ids = [args.loja] if args.loja else list(load_stores())
+    for store_id in store_ids:
+        if store_id not in load_stores():
+            parser.error(f"loja desconhecida: {store_id}")
+        os.environ[STORE_ENV] = store_id
+        stats = run_cleanup(args.dias_vendido)
+        reasons = ", ".join(f"{count} {reason}" for reason, count in stats["reasons"].items()) or "nenhum"
+        print(f"[{store_id}] itens sem fotos agora: {stats['skus']} ({reasons}); "
+              f"{stats['blobs']} arquivos em quarentena ({stats['bytes'] / 1024 / 1024:.1f} MB); "
+              f"{stats['purged_bytes'] / 1024 / 1024:.1f} MB apagados da quarentena")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
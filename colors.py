@@ -0,0 +1,68 @@
+\
+import numpy as np
+
+# Normalised colour names used in items.color, with a reference RGB each
+COLOR_PALETTE = {
+    "preto": (20, 20, 20),
+    "cinza": (128, 128, 128),
+    "branco": (245, 245, 245),
+    "bege": (222, 200, 165),
+    "caramelo": (175, 110, 55),
+    "marrom": (100, 65, 40),
+    "vinho": (115, 20, 40),
+    "vermelho": (200, 30, 35),
+    "rosa": (235, 140, 170),
+    "laranja": (240, 130, 40),
+    "amarelo": (240, 210, 60),
+    "verde": (60, 140, 70),
+    "verde-oliva": (110, 115, 55),
+    "azul-claro": (140, 185, 225),
+    "azul": (40, 90, 180),
+    "azul-marinho": (25, 35, 75),
+    "roxo": (110, 60, 150),
+}
+COLOR_NAMES = list(COLOR_PALETTE)
+KMEANS_CLUSTERS = 4
+KMEANS_ITERATIONS = 10
+# Share of the frame (centred) where the piece is; the rest is mostly background
+CENTER_CROP = 0.6
+
+def _to_lab(rgb: np.ndarray) -> np.ndarray:
+    """sRGB (0-255, shape (n, 3)) to CIE Lab, so distances follow perceived difference."""
+    c = rgb / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124, 0.2126, 0.0193],
+                        [0.3576, 0.7152, 0.1192],
+                        [0.1805, 0.0722, 0.9505]])
+    xyz /= np.array([0.9505, 1.0, 1.089])
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+_PALETTE_LAB = _to_lab(np.array(list(COLOR_PALETTE.values()), dtype=float))
+
+def kmeans(points: np.ndarray, k: int = KMEANS_CLUSTERS, iterations: int = KMEANS_ITERATIONS):
+    """Plain vectorised k-means. Returns (centres, cluster sizes), largest cluster first."""
+    rng = np.random.default_rng(0)
+    centres = points[rng.choice(len(points), size=min(k, len(points)), replace=False)]
+    for _ in range(iterations):
+        labels = ((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        for n in range(len(centres)):
+            members = points[labels == n]
+            if len(members):
+                centres[n] = members.mean(axis=0)
+    sizes = np.bincount(labels, minlength=len(centres))
+    order = sizes.argsort()[::-1]
+    return centres[order], sizes[order]
+
+def dominant_color(img) -> str:
+    """Normalised colour name of the piece: largest k-means cluster of the centre
+    of the photo, ignoring near-white background, matched to COLOR_PALETTE in Lab."""
+    w, h = img.size
+    dx, dy = int(w * (1 - CENTER_CROP) / 2), int(h * (1 - CENTER_CROP) / 2)
+    pixels = np.asarray(img.convert("RGB").crop((dx, dy, w - dx, h - dy)), dtype=float).reshape(-1, 3)
+    foreground = pixels[pixels.min(axis=1) < 225]
+    if len(foreground) >= len(pixels) // 10:
+        pixels = foreground
+    centres, _ = kmeans(_to_lab(pixels))
+    distances = ((_PALETTE_LAB - centres[0]) ** 2).sum(axis=1)
+    return COLOR_NAMES[int(distances.argmin())]
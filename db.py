@@ -1,20 +1,129 @@
 \
 import sqlite3
+import json
+import os
+from pathlib import Path
 from contextlib import contextmanager
 
-DB_PATH = "brecho.db"
+DB_PATH = "brecho.db"            # database of the default store
+STORES_FILE = "stores.json"      # store registry: {store_id: {"name", "db_path"}}
+DEFAULT_STORE = "principal"
+# Store used outside a Streamlit session (command-line tools), e.g. BRECHO_STORE=loja2
+STORE_ENV = "BRECHO_STORE"
+# Tables exposed (with a store_id column) by get_report_conn
+REPORT_TABLES = ("consignors", "items", "sales", "item_aging", "aging_summary", "photos", "photo_blobs",
+                 "photo_quarantine")
+# app_meta key of the photo index version (see the photos_index triggers)
+PHOTO_INDEX_KEY = "photo_index_version"
+
+# Aging bucket of a listing date: 0: 0-30 | 1: 31-60 | 2: 61-90 | 3: 90+ days. Same
+# boundaries as julianday('now') - julianday(listed_at) > 30 (more than 30 full
+# days), written as text comparisons so they can use the listed_at index.
+# Undated items (NULL) stay in bucket 0, as those comparisons left them.
+AGING_BUCKET_SQL = """CASE WHEN {col} < datetime('now','-90 days') THEN 3
+     WHEN {col} < datetime('now','-60 days') THEN 2
+     WHEN {col} < datetime('now','-30 days') THEN 1
+     ELSE 0 END"""
+
+# Gallery sort key: items without a listing date sort after the dated ones
+GALLERY_KEY_SQL = "COALESCE(listed_at, '')"
+
+# Optimistic concurrency: tables with this column get it incremented on every update
+VERSION_COLUMN = "version"
+
+_stores = None
+_columns = {}
+_initialised = set()
+
+def load_stores() -> dict:
+    global _stores
+    if _stores is None:
+        if os.path.exists(STORES_FILE):
+            with open(STORES_FILE, encoding="utf-8") as f:
+                _stores = json.load(f)
+        else:
+            _stores = {DEFAULT_STORE: {"name": "Brechó", "db_path": DB_PATH}}
+    return _stores
+
+def register_store(store_id: str, name: str, db_path: str):
+    if not store_id.replace("_", "").isalnum():
+        raise ValueError("ID da loja deve conter apenas letras, números e _")
+    stores = dict(load_stores())
+    stores[store_id] = {"name": name, "db_path": db_path}
+    with open(STORES_FILE, "w", encoding="utf-8") as f:
+        json.dump(stores, f, ensure_ascii=False, indent=2)
+    global _stores
+    _stores = stores
+    init_db(store_id)
+
+def current_store() -> str:
+    """Store selected in the Streamlit session, else BRECHO_STORE, else the default store."""
+    stores = load_stores()
+    store_id = None
+    try:
+        from streamlit import runtime
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        # Only inside a running script: command-line tools and background threads
+        # would only get "missing ScriptRunContext" warnings from session_state
+        if runtime.exists() and get_script_run_ctx(suppress_warning=True):
+            import streamlit as st
+            store_id = st.session_state.get("store_id")
+    except Exception:
+        pass
+    store_id = store_id or os.environ.get(STORE_ENV)
+    if store_id in stores:
+        return store_id
+    return DEFAULT_STORE if DEFAULT_STORE in stores else next(iter(stores))
+
+def store_db_path(store_id: str = None) -> str:
+    return load_stores()[store_id or current_store()]["db_path"]
 
 @contextmanager
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+def get_conn(store_id: str = None):
+    conn = sqlite3.connect(store_db_path(store_id), check_same_thread=False)
     try:
         yield conn
     finally:
         conn.commit()
         conn.close()
 
-def init_db():
-    with get_conn() as conn:
+@contextmanager
+def get_report_conn(store_ids=None):
+    """
+    Read-only connection over several stores. Each store file is ATTACHed and
+    REPORT_TABLES are exposed as TEMP views (UNION ALL) with a leading store_id
+    column, so report queries run unchanged but should join on store_id too.
+    Stores are initialised first and columns listed by name, so a store missing
+    tables or with columns added in another order still lines up.
+    """
+    store_ids = list(store_ids or [current_store()])
+    for store_id in store_ids:
+        ensure_db(store_id)
+    conn = sqlite3.connect(":memory:", uri=True, check_same_thread=False)
+    try:
+        for n, store_id in enumerate(store_ids):
+            uri = Path(store_db_path(store_id)).resolve().as_uri() + "?mode=ro"
+            conn.execute("ATTACH DATABASE ? AS ?", (uri, f"s{n}"))
+        for table in REPORT_TABLES:
+            columns = ", ".join(r[1] for r in conn.execute(f"PRAGMA s0.table_info({table})"))
+            union = " UNION ALL ".join(
+                f"SELECT '{store_id}' AS store_id, {columns} FROM s{n}.{table}"
+                for n, store_id in enumerate(store_ids)
+            )
+            conn.execute(f"CREATE TEMP VIEW {table} AS {union}")
+        yield conn
+    finally:
+        conn.close()
+
+def ensure_db(store_id: str = None):
+    """init_db once per process for a store file (schema and column migrations)."""
+    path = store_db_path(store_id)
+    if path not in _initialised:
+        init_db(store_id)
+        _initialised.add(path)
+
+def init_db(store_id: str = None):
+    with get_conn(store_id) as conn:
         c = conn.cursor()
         # Consignors
         c.execute("""
@@ -64,6 +173,39 @@ def init_db():
             FOREIGN KEY(consignor_id) REFERENCES consignors(id)
         );
         """)
+        add_column(c, "items", VERSION_COLUMN, "INTEGER NOT NULL DEFAULT 0")
+        # When the item was deactivated (photo cleanup retention), kept by the triggers below;
+        # items already inactive start counting at the migration
+        if add_column(c, "items", "inactive_since", "TEXT"):
+            c.execute("UPDATE items SET inactive_since = datetime('now') WHERE active = 0")
+        c.execute("""
+        CREATE TRIGGER IF NOT EXISTS items_inactive_ai AFTER INSERT ON items
+        WHEN NEW.active = 0 AND NEW.inactive_since IS NULL
+        BEGIN
+            UPDATE items SET inactive_since = datetime('now') WHERE sku = NEW.sku;
+        END;
+        """)
+        c.execute("""
+        CREATE TRIGGER IF NOT EXISTS items_inactive_au AFTER UPDATE OF active ON items
+        WHEN NEW.active IS NOT OLD.active
+        BEGIN
+            UPDATE items SET inactive_since = CASE WHEN NEW.active = 0 THEN datetime('now') END
+            WHERE sku = NEW.sku;
+        END;
+        """)
+        # Gallery pages walk these in (listed_at, sku) order; partial = only items on sale
+        c.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_items_gallery ON items({GALLERY_KEY_SQL}, sku)
+        WHERE active = 1 AND sold_at IS NULL;
+        """)
+        c.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_items_gallery_category ON items(category, {GALLERY_KEY_SQL}, sku)
+        WHERE active = 1 AND sold_at IS NULL;
+        """)
+        c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_items_gallery_brand ON items(brand COLLATE NOCASE)
+        WHERE active = 1 AND sold_at IS NULL;
+        """)
         # Sales
         c.execute("""
         CREATE TABLE IF NOT EXISTS sales (
@@ -81,17 +223,310 @@ def init_db():
             FOREIGN KEY(sku) REFERENCES items(sku)
         );
         """)
+        # App metadata (last aging roll, etc.)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        """)
+        # Photo blobs (content-addressed files, hash = sha256 of the uploaded bytes)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS photo_blobs (
+            hash TEXT PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            bytes INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT (datetime('now'))
+        );
+        """)
+        # Perceptual hash (64-bit dHash, hex) for near-duplicate search
+        add_column(c, "photo_blobs", "phash", "TEXT")
+        # Dominant colour (normalised name, see colors.COLOR_PALETTE)
+        add_column(c, "photo_blobs", "color", "TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_photo_blobs_refcount ON photo_blobs(refcount);")
+        # Photo manifest: SKU -> blob links (one row per position)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS photos (
+            sku TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            bytes INTEGER,
+            hash TEXT,
+            created_at TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY(sku, position),
+            FOREIGN KEY(sku) REFERENCES items(sku)
+        );
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_photos_hash ON photos(hash);")
+        # Photo links taken out by the cleanup job (kept so a SKU can be restored)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS photo_quarantine (
+            sku TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            reason TEXT,             -- orphaned | sold | inactive
+            quarantined_at TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY(sku, position)
+        );
+        """)
+        # Perceptual hash copied at unlink time: duplicate search keeps finding the
+        # piece after the cleanup removes its blob (re-consigned items)
+        if add_column(c, "photo_quarantine", "phash", "TEXT"):
+            c.execute("""
+                UPDATE photo_quarantine
+                SET phash = (SELECT b.phash FROM photo_blobs b WHERE b.hash = photo_quarantine.hash)
+            """)
+        # Blob reference counts follow the SKU links
+        c.execute("""
+        CREATE TRIGGER IF NOT EXISTS photos_blob_ai AFTER INSERT ON photos
+        BEGIN
+            UPDATE photo_blobs SET refcount = refcount + 1 WHERE hash = NEW.hash;
+        END;
+        """)
+        c.execute("""
+        CREATE TRIGGER IF NOT EXISTS photos_blob_ad AFTER DELETE ON photos
+        BEGIN
+            UPDATE photo_blobs SET refcount = refcount - 1 WHERE hash = OLD.hash;
+        END;
+        """)
+        c.execute("""
+        CREATE TRIGGER IF NOT EXISTS photos_blob_au AFTER UPDATE OF hash ON photos
+        BEGIN
+            UPDATE photo_blobs SET refcount = refcount - 1 WHERE hash = OLD.hash;
+            UPDATE photo_blobs SET refcount = refcount + 1 WHERE hash = NEW.hash;
+        END;
+        """)
+        # Photo index version: bumped on every link or perceptual hash change, so
+        # duplicates.photo_index knows when to rebuild from one app_meta read
+        for trigger, event in (("photos_index_ai", "INSERT ON photos"),
+                               ("photos_index_ad", "DELETE ON photos"),
+                               ("photos_index_au", "UPDATE OF sku, hash ON photos"),
+                               ("photo_blobs_index_ai", "INSERT ON photo_blobs"),
+                               ("photo_blobs_index_au", "UPDATE OF phash ON photo_blobs"),
+                               ("photo_quarantine_index_ai", "INSERT ON photo_quarantine"),
+                               ("photo_quarantine_index_ad", "DELETE ON photo_quarantine")):
+            c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event}
+            BEGIN
+                INSERT INTO app_meta(key, value) VALUES ('{PHOTO_INDEX_KEY}', 1)
+                ON CONFLICT(key) DO UPDATE SET value = value + 1;
+            END;
+            """)
+        # Last label printed per SKU, with the price it showed (label_history.py)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS label_prints (
+            sku TEXT PRIMARY KEY,
+            list_price REAL,
+            markdown_stage INTEGER NOT NULL DEFAULT 0,
+            printed_at TEXT NOT NULL DEFAULT (datetime('now')),
+            prints INTEGER NOT NULL DEFAULT 1
+        );
+        """)
+        # Print history reads label_jobs now
+        c.execute("DROP INDEX IF EXISTS idx_label_prints_printed_at;")
+        # One row per confirmed print job (sent to the printer or marked as printed)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS label_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            printed_at TEXT NOT NULL DEFAULT (datetime('now')),
+            labels INTEGER NOT NULL,
+            reprints INTEGER NOT NULL DEFAULT 0,
+            target TEXT              -- printer address, or empty for a downloaded file
+        );
+        """)
+        init_aging(c)
+
+def add_column(c, table: str, column: str, decl: str) -> bool:
+    """ALTER TABLE ADD COLUMN for databases created before the column existed. True if added."""
+    if column not in [r[1] for r in c.execute(f"PRAGMA table_info({table})")]:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        return True
+    return False
+
+def init_aging(c):
+    # Tables from before undated items were counted (listed_at NOT NULL) also have
+    # triggers with the old "<= date()" boundaries: drop the derived data, then
+    # aging.roll_forward() rebuilds it
+    if any(r[1] == "listed_at" and r[3] for r in c.execute("PRAGMA table_info(item_aging)")):
+        for trigger in ("items_aging_ai", "items_aging_au", "items_aging_ad"):
+            c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        c.execute("DROP TABLE item_aging")
+        c.execute("DROP TABLE IF EXISTS aging_summary")
+        c.execute("DELETE FROM app_meta WHERE key = 'aging_rolled_on'")
+    # Active unsold items with their aging bucket, kept in sync by triggers on items
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS item_aging (
+        sku TEXT PRIMARY KEY,
+        category TEXT NOT NULL,
+        size TEXT NOT NULL,
+        listed_at TEXT,
+        markdown_stage INTEGER NOT NULL,
+        bucket INTEGER NOT NULL
+    );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_item_aging_bucket ON item_aging(bucket, listed_at);")
+    # Counts per category × size × bucket × markdown stage
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS aging_summary (
+        category TEXT NOT NULL,
+        size TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        markdown_stage INTEGER NOT NULL,
+        qty INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(category, size, bucket, markdown_stage)
+    );
+    """)
+    aging_row = f"""NEW.sku, COALESCE(NEW.category,''), COALESCE(NEW.size,''), NEW.listed_at,
+               COALESCE(NEW.markdown_stage,0), {AGING_BUCKET_SQL.format(col='NEW.listed_at')}"""
+    aging_cond = "NEW.active = 1 AND NEW.sold_at IS NULL"
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS items_aging_ai AFTER INSERT ON items
+    WHEN {aging_cond}
+    BEGIN
+        INSERT INTO item_aging(sku, category, size, listed_at, markdown_stage, bucket)
+        VALUES ({aging_row});
+    END;
+    """)
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS items_aging_au
+    AFTER UPDATE OF sku, category, size, listed_at, markdown_stage, sold_at, active ON items
+    BEGIN
+        DELETE FROM item_aging WHERE sku = OLD.sku;
+        INSERT INTO item_aging(sku, category, size, listed_at, markdown_stage, bucket)
+        SELECT {aging_row} WHERE {aging_cond};
+    END;
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS items_aging_ad AFTER DELETE ON items
+    BEGIN
+        DELETE FROM item_aging WHERE sku = OLD.sku;
+    END;
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS item_aging_summary_ai AFTER INSERT ON item_aging
+    BEGIN
+        INSERT INTO aging_summary(category, size, bucket, markdown_stage, qty)
+        VALUES (NEW.category, NEW.size, NEW.bucket, NEW.markdown_stage, 1)
+        ON CONFLICT(category, size, bucket, markdown_stage) DO UPDATE SET qty = qty + 1;
+    END;
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS item_aging_summary_ad AFTER DELETE ON item_aging
+    BEGIN
+        UPDATE aging_summary SET qty = qty - 1
+        WHERE category = OLD.category AND size = OLD.size
+          AND bucket = OLD.bucket AND markdown_stage = OLD.markdown_stage;
+    END;
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS item_aging_summary_au AFTER UPDATE OF bucket ON item_aging
+    BEGIN
+        UPDATE aging_summary SET qty = qty - 1
+        WHERE category = OLD.category AND size = OLD.size
+          AND bucket = OLD.bucket AND markdown_stage = OLD.markdown_stage;
+        INSERT INTO aging_summary(category, size, bucket, markdown_stage, qty)
+        VALUES (NEW.category, NEW.size, NEW.bucket, NEW.markdown_stage, 1)
+        ON CONFLICT(category, size, bucket, markdown_stage) DO UPDATE SET qty = qty + 1;
+    END;
+    """)
 
 def upsert(table: str, key_field: str, data: dict):
     keys = list(data.keys())
     placeholders = ",".join(["?"]*len(keys))
     columns = ",".join(keys)
     update_clause = ",".join([f"{k}=excluded.{k}" for k in keys if k != key_field])
-    sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) "\
-          f"ON CONFLICT({key_field}) DO UPDATE SET {update_clause};"
     with get_conn() as conn:
+        if VERSION_COLUMN in table_columns(table, conn=conn) and VERSION_COLUMN not in keys:
+            update_clause += f",{VERSION_COLUMN}={VERSION_COLUMN}+1"
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) "\
+              f"ON CONFLICT({key_field}) DO UPDATE SET {update_clause};"
         conn.execute(sql, [data[k] for k in keys])
 
+class VersionConflict(ValueError):
+    """Row changed (or was deleted) since it was read: its version no longer matches."""
+
+def table_columns(table: str, store_id: str = None, conn=None) -> tuple:
+    """
+    Column names of a table (PRAGMA table_info), cached per database file.
+    Inside a transaction pass its connection: no second connection is opened.
+    """
+    if conn is not None:
+        path = conn.execute("PRAGMA database_list").fetchone()[2]
+    else:
+        path = store_db_path(store_id)
+    cache_key = (os.path.realpath(path), table)
+    if cache_key not in _columns:
+        if conn is not None:
+            columns = tuple(r[1] for r in conn.execute(f"PRAGMA table_info({table})"))
+        else:
+            with get_conn(store_id) as own_conn:
+                columns = tuple(r[1] for r in own_conn.execute(f"PRAGMA table_info({table})"))
+        if not columns:
+            raise ValueError(f"Tabela desconhecida: {table}")
+        _columns[cache_key] = columns
+    return _columns[cache_key]
+
+def update_fields(table: str, key: dict, values: dict, expected_version: int = None, conn=None) -> int:
+    """
+    UPDATE only the given columns of one row: update_fields("items", {"sku": sku}, {"photos_url": url}).
+    Column names are checked against the table schema. With expected_version,
+    the row must still have that version (VersionConflict otherwise); tables with
+    a version column get it incremented. Returns the number of rows updated.
+    """
+    row = {**key, **values}
+    if expected_version is not None:
+        row[VERSION_COLUMN] = expected_version
+    return update_fields_many(table, list(key), [row], conn)
+
+def update_fields_many(table: str, key_fields, rows, conn=None) -> int:
+    """
+    Bulk partial updates: rows are dicts with the key field(s) plus the columns
+    to set, and optionally "version" as the expected version. Rows setting the
+    same columns share one executemany; a version mismatch rolls the whole
+    batch back (when the connection is ours). Returns the number of rows updated.
+    """
+    if isinstance(key_fields, str):
+        key_fields = [key_fields]
+    if conn is None:
+        with get_conn() as conn:
+            try:
+                return _update_many(conn, table, key_fields, rows)
+            except Exception:
+                conn.rollback()
+                raise
+    return _update_many(conn, table, key_fields, rows)
+
+def _update_many(conn, table, key_fields, rows) -> int:
+    groups = {}
+    for row in rows:
+        fields = tuple(k for k in row if k not in key_fields and k != VERSION_COLUMN)
+        groups.setdefault((fields, VERSION_COLUMN in row), []).append(row)
+    updated = 0
+    for (fields, check_version), group in groups.items():
+        columns = table_columns(table, conn=conn)
+        unknown = [name for name in [*key_fields, *fields] if name not in columns]
+        if unknown:
+            raise ValueError(f"Colunas desconhecidas em {table}: {', '.join(unknown)}")
+        if check_version and VERSION_COLUMN not in columns:
+            raise ValueError(f"Tabela {table} não tem coluna {VERSION_COLUMN}")
+        where = [*key_fields, VERSION_COLUMN] if check_version else list(key_fields)
+        sets = [f"{k}=?" for k in fields]
+        if VERSION_COLUMN in columns:
+            sets.append(f"{VERSION_COLUMN}={VERSION_COLUMN}+1")
+        sql = f"UPDATE {table} SET {', '.join(sets)} WHERE {' AND '.join(f'{k}=?' for k in where)}"
+        # rowcount leaves out rows changed by triggers
+        count = conn.executemany(sql, [[row[k] for k in fields] + [row[k] for k in where]
+                                       for row in group]).rowcount
+        if check_version and count < len(group):
+            raise VersionConflict(f"Registro de {table} alterado por outra pessoa; recarregue e tente de novo")
+        updated += count
+    return updated
+
 def delete(table: str, key_field: str, key_value: str):
     with get_conn() as conn:
         conn.execute(f"DELETE FROM {table} WHERE {key_field}=?", (key_value,))
@@ -102,3 +537,20 @@ def fetchall(sql: str, params=()):
         cols = [d[0] for d in cur.description]
         rows = cur.fetchall()
     return cols, rows
+
+def iter_rows(sql: str, params=(), chunk_size: int = 500):
+    """Rows of a query fetched chunk_size at a time, for jobs over many rows."""
+    with get_conn() as conn:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+
+def fetchall_report(sql: str, params=(), store_ids=None):
+    with get_report_conn(store_ids) as conn:
+        cur = conn.execute(sql, params)
+        cols = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+    return cols, rows
@@ -0,0 +1,116 @@
+\
+from itertools import combinations
+from db import get_conn, ensure_db, fetchall_report, load_stores, PHOTO_INDEX_KEY
+
+# dHash bits that may differ for two photos to count as the same piece
+DUPLICATE_DISTANCE = 8
+# Multi-index hashing: the 64-bit hash is split in CHUNKS parts of CHUNK_BITS bits
+CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+_popcount = getattr(int, "bit_count", None) or (lambda x: bin(x).count("1"))
+
+def _flips(value: int, max_bits: int):
+    """value and every value differing from it in at most max_bits bits."""
+    yield value
+    for n in range(1, max_bits + 1):
+        for bits in combinations(range(CHUNK_BITS), n):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+class HammingIndex:
+    """
+    Multi-index hashing over 64-bit hashes. Two hashes within distance r have
+    at least one 16-bit chunk within r // 4 bits of each other (pigeonhole),
+    so a search probes the chunk tables for those neighbours only and checks
+    the few candidates found, instead of comparing against every photo.
+    """
+
+    def __init__(self):
+        self.hashes = []
+        self.values = []
+        self.tables = [{} for _ in range(CHUNKS)]
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, phash: str, value):
+        h = int(phash, 16)
+        n = len(self.hashes)
+        self.hashes.append(h)
+        self.values.append(value)
+        for i, table in enumerate(self.tables):
+            table.setdefault((h >> (i * CHUNK_BITS)) & CHUNK_MASK, []).append(n)
+
+    def search(self, phash: str, radius: int = DUPLICATE_DISTANCE):
+        """[(distance, value)] of every entry within radius, closest first."""
+        h = int(phash, 16)
+        candidates = set()
+        for i, table in enumerate(self.tables):
+            chunk = (h >> (i * CHUNK_BITS)) & CHUNK_MASK
+            for probe in _flips(chunk, radius // CHUNKS):
+                candidates.update(table.get(probe, ()))
+        found = []
+        for n in candidates:
+            d = _popcount(h ^ self.hashes[n])
+            if d <= radius:
+                found.append((d, self.values[n]))
+        return sorted(found, key=lambda f: f[0])
+
+_index = (None, None)
+
+def _index_versions(store_ids) -> tuple:
+    """Each store's photo index version (app_meta, bumped by triggers on the photo tables)."""
+    versions = []
+    for store_id in store_ids:
+        ensure_db(store_id)
+        with get_conn(store_id) as conn:
+            row = conn.execute("SELECT value FROM app_meta WHERE key = ?", (PHOTO_INDEX_KEY,)).fetchone()
+        versions.append((store_id, row[0] if row else None))
+    return tuple(versions)
+
+def photo_index() -> HammingIndex:
+    """
+    Index of every photo of every store, linked or taken out by the cleanup
+    (sold items included, to catch re-consigned pieces: quarantined links keep
+    their perceptual hash after the blob is gone). Values are (store_id, sku,
+    hash); rebuilt only when a store's photo index version changes.
+    """
+    global _index
+    store_ids = list(load_stores())
+    fingerprint = _index_versions(store_ids)
+    if _index[0] != fingerprint:
+        _, rows = fetchall_report("""
+            SELECT p.store_id, p.sku, b.hash, b.phash
+            FROM photos p
+            JOIN photo_blobs b ON b.hash = p.hash AND b.store_id = p.store_id
+            WHERE b.phash IS NOT NULL
+            UNION ALL
+            SELECT store_id, sku, hash, phash FROM photo_quarantine WHERE phash IS NOT NULL
+        """, (), store_ids)
+        index = HammingIndex()
+        for store_id, sku, digest, phash in rows:
+            index.add(phash, (store_id, sku, digest))
+        _index = (fingerprint, index)
+    return _index[1]
+
+def find_similar(phash: str, radius: int = DUPLICATE_DISTANCE, exclude_sku: str = None):
+    """[(distance, store_id, sku, hash)] of archived photos close to phash."""
+    return [(d, *value) for d, value in photo_index().search(phash, radius) if value[1] != exclude_sku]
+
+def duplicate_pairs(radius: int = DUPLICATE_DISTANCE):
+    """
+    Pairs of different SKUs with near-identical photos:
+    [(distance, (store_id, sku), (store_id, sku))], closest first.
+    """
+    index = photo_index()
+    pairs = {}
+    for h, value in zip(index.hashes, index.values):
+        for d, other in index.search(f"{h:016x}", radius):
+            a, b = sorted([value[:2], other[:2]])
+            if a != b and pairs.get((a, b), radius + 1) > d:
+                pairs[(a, b)] = d
+    return sorted(((d, a, b) for (a, b), d in pairs.items()), key=lambda p: p[0])
@@ -0,0 +1,65 @@
+\
+import os
+from functools import lru_cache
+from pathlib import Path
+from PIL import ImageFont
+
+# TTFs dropped in fonts/ (next to the app) win over system fonts; BRECHO_FONT /
+# BRECHO_FONT_BOLD point to specific files
+FONTS_DIR = Path(__file__).parent / "fonts"
+FONT_CANDIDATES = {
+    "regular": [
+        "Arial.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf", "Lato-Regular.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+        "/usr/share/fonts/TTF/DejaVuSans.ttf",
+        "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+        "/System/Library/Fonts/Supplemental/Arial.ttf",
+        "/Library/Fonts/Arial.ttf",
+        "C:/Windows/Fonts/arial.ttf",
+    ],
+    "bold": [
+        "Arial Bold.ttf", "DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf", "Lato-Bold.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+        "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf",
+        "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+        "/Library/Fonts/Arial Bold.ttf",
+        "C:/Windows/Fonts/arialbd.ttf",
+    ],
+}
+# reportlab built-ins used when no TTF is found
+PDF_FALLBACK = {"regular": "Helvetica", "bold": "Helvetica-Bold"}
+
+@lru_cache(maxsize=None)
+def font_path(weight: str = "regular"):
+    """First TTF found for the weight (bold falls back to regular), or None. Resolved once."""
+    env = os.environ.get("BRECHO_FONT_BOLD" if weight == "bold" else "BRECHO_FONT")
+    candidates = ([env] if env else []) + FONT_CANDIDATES[weight]
+    for candidate in candidates:
+        for path in (FONTS_DIR / candidate, Path(candidate)):
+            if path.is_file():
+                return str(path)
+    return font_path("regular") if weight == "bold" else None
+
+@lru_cache(maxsize=64)
+def get_font(size: int, weight: str = "regular") -> ImageFont.FreeTypeFont:
+    """Pillow font at a pixel size, cached: label batches never reload fonts."""
+    path = font_path(weight)
+    if path:
+        return ImageFont.truetype(path, size)
+    # Pillow's built-in scalable font (needs FreeType; bitmap font otherwise)
+    return ImageFont.load_default(size)
+
+@lru_cache(maxsize=None)
+def pdf_font(weight: str = "regular") -> str:
+    """reportlab font name for the weight: the same TTF as the raster labels, registered once."""
+    path = font_path(weight)
+    if not path:
+        return PDF_FALLBACK[weight]
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    name = f"Brecho-{weight}"
+    pdfmetrics.registerFont(TTFont(name, path))
+    return name
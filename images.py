@@ -0,0 +1,227 @@
+\
+import io
+import os
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from PIL import Image, ImageOps, features
+from colors import dominant_color
+
+PHOTOS_DIR = Path("photos")
+# Content-addressed store: photos/blobs/<h[:2]>/<h>.<ext>, h = sha256 of the uploaded bytes
+BLOBS_DIR = PHOTOS_DIR / "blobs"
+# Unused blob files wait here (photos/quarantine/<date>/<h[:2]>/...) before being deleted
+QUARANTINE_DIR = PHOTOS_DIR / "quarantine"
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Refuse sources above this before decoding (48MP phone photos fit)
+MAX_SOURCE_PIXELS = 60_000_000
+# Leave one core for the Streamlit server
+MAX_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+# Output profiles generated once at upload time, one per channel.
+# "social" is the main file (photos/blobs/ab/<hash>.jpg), the others live
+# in a subfolder named after the profile (photos/blobs/ab/web/<hash>.webp).
+# max_bytes: quality is lowered in steps until the file fits (down to MIN_QUALITY).
+PROFILES = {
+    "thumb":     {"max_side": 160,  "format": "JPEG", "quality": 80},
+    "card":      {"max_side": 480,  "format": "JPEG", "quality": 82},
+    "social":    {"max_side": 1080, "format": "JPEG", "quality": 85},
+    "instagram": {"max_side": 1080, "format": "JPEG", "quality": 88, "square": True},
+    "web":       {"max_side": 1080, "format": "WEBP", "quality": 80, "max_bytes": 150_000},
+}
+if features.check("avif"):
+    PROFILES["web_avif"] = {"max_side": 1080, "format": "AVIF", "quality": 60, "max_bytes": 100_000}
+MAIN_SIZE = "social"
+MIN_QUALITY = 50
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "AVIF": "avif", "PNG": "png"}
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def blob_path(digest: str) -> Path:
+    return BLOBS_DIR / digest[:2] / f"{digest}.{EXTENSIONS[PROFILES[MAIN_SIZE]['format']]}"
+
+def variant_path(photo_path, size: str) -> Path:
+    photo_path = Path(photo_path)
+    if size == MAIN_SIZE:
+        return photo_path
+    ext = EXTENSIONS[PROFILES[size]["format"]]
+    return photo_path.parent / size / f"{photo_path.stem}.{ext}"
+
+def open_reduced(src, max_side: int = PROFILES[MAIN_SIZE]["max_side"]) -> Image.Image:
+    """
+    Decode src at close to max_side instead of full resolution: JPEGs use draft
+    mode (DCT scaling by 1/2..1/8), other formats reduce() right after loading.
+    EXIF orientation is applied and metadata dropped (only the ICC profile kept).
+    """
+    img = Image.open(src)
+    if img.width * img.height > MAX_SOURCE_PIXELS:
+        raise ValueError(f"Imagem muito grande ({img.width}x{img.height})")
+    if img.format == "JPEG":
+        img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    factor = min(img.width, img.height) // max_side
+    if factor >= 2:
+        img = img.reduce(factor)
+    icc_profile = img.info.get("icc_profile")
+    img.info = {"icc_profile": icc_profile} if icc_profile else {}
+    return img
+
+def _encode(img: Image.Image, profile: dict) -> bytes:
+    """Encode img for a profile, lowering quality until max_bytes is met."""
+    fmt = profile["format"]
+    if img.mode not in ("RGB", "L"):
+        # Flatten transparency on white: PNG uploads become JPEG/WebP like the rest
+        background = Image.new("RGB", img.size, "white")
+        background.paste(img, mask=img.convert("RGBA").getchannel("A"))
+        # Same colour space, so the source profile still applies (not for CMYK sources)
+        if img.info.get("icc_profile") and img.mode != "CMYK":
+            background.info["icc_profile"] = img.info["icc_profile"]
+        img = background
+    params = {"icc_profile": img.info["icc_profile"]} if img.info.get("icc_profile") else {}
+    if fmt == "JPEG":
+        params.update(optimize=True, progressive=True)
+    elif fmt == "WEBP":
+        params.update(method=6)
+    quality = profile["quality"]
+    while True:
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, quality=quality, **params)
+        if len(buf.getvalue()) <= profile.get("max_bytes", float("inf")) or quality <= MIN_QUALITY:
+            return buf.getvalue()
+        quality -= 10
+
+def save_derivatives(img: Image.Image, photo_path, sizes=None) -> dict:
+    """
+    Save every profile of img (or only `sizes`), largest first, each resized
+    from the previous one. Returns {profile: bytes written}.
+    """
+    photo_path = Path(photo_path)
+    out = {}
+    current = img
+    for size, profile in sorted(PROFILES.items(), key=lambda kv: kv[1]["max_side"], reverse=True):
+        current = current.copy()
+        max_side = profile["max_side"]
+        current.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        if sizes is None or size in sizes:
+            output = current
+            if profile.get("square"):
+                output = ImageOps.pad(current, (max_side, max_side), color="white")
+                output.info = current.info
+            data = _encode(output, profile)
+            path = variant_path(photo_path, size)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            out[size] = len(data)
+    return out
+
+def file_info(path) -> dict:
+    """Manifest data of a saved photo: dimensions, size in bytes and sha256."""
+    path = Path(path)
+    data = path.read_bytes()
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+    return {"file_path": str(path), "width": width, "height": height,
+            "bytes": len(data), "hash": content_hash(data)}
+
+def dhash(img: Image.Image) -> str:
+    """64-bit difference hash (hex): brighter-than-right-neighbour bits of a 9x8 grayscale."""
+    small = img.convert("L").resize((9, 8), Image.Resampling.BOX)
+    px = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+def photo_features(src) -> dict:
+    """Pool worker: perceptual hash and dominant colour of a photo file or raw bytes."""
+    if isinstance(src, bytes):
+        src = io.BytesIO(src)
+    max_side = PROFILES["thumb"]["max_side"]
+    with open_reduced(src, max_side) as img:
+        phash = dhash(img)
+        img.thumbnail((max_side, max_side))
+        return {"phash": phash, "color": dominant_color(img)}
+
+def process_photo(src, photo_path, sizes=None) -> dict:
+    """Pool worker: decode src (file path or raw bytes), write its derivatives
+    and return the main file's manifest data plus the bytes of each output
+    ("variants"), of the source ("source_bytes"), its perceptual hash and colour."""
+    if isinstance(src, bytes):
+        source_bytes = len(src)
+        src = io.BytesIO(src)
+    else:
+        source_bytes = os.path.getsize(src)
+    with open_reduced(src) as img:
+        variants = save_derivatives(img, photo_path, sizes)
+        phash = dhash(img)
+        img.thumbnail((PROFILES["thumb"]["max_side"],) * 2)
+        color = dominant_color(img)
+    return {**file_info(photo_path), "variants": variants, "source_bytes": source_bytes,
+            "phash": phash, "color": color}
+
+def compression_report(results) -> list:
+    """Per-profile totals of process_photo results: [(profile, bytes, ratio vs source)]."""
+    results = [r for r in results if r]
+    source = sum(r["source_bytes"] for r in results)
+    totals = {}
+    for r in results:
+        for size, nbytes in r["variants"].items():
+            totals[size] = totals.get(size, 0) + nbytes
+    return [(size, nbytes, source / nbytes if nbytes else 0.0) for size, nbytes in totals.items()]
+
+def make_preview(src, size: str = "card") -> Image.Image:
+    """Small preview of an upload, decoded straight at reduced size."""
+    max_side = PROFILES[size]["max_side"]
+    img = open_reduced(src, max_side)
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return img
+
+def process_many(jobs, progress=None, max_workers=MAX_WORKERS, worker=process_photo):
+    """
+    Run worker (process_photo by default) for each (src, photo_path[, sizes]) job
+    in a bounded process pool.
+    progress(done, total) is called from the caller's thread as jobs finish.
+    Returns (results, errors): results in job order (None on failure) and
+    a list of (photo_path, message).
+    """
+    jobs = list(jobs)
+    results = [None] * len(jobs)
+    errors = []
+    if not jobs:
+        return results, errors
+    workers = min(max_workers, len(jobs))
+    # spawn: never fork the (multi-threaded) Streamlit server
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(worker, *job): n for n, job in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), 1):
+            n = futures[future]
+            try:
+                results[n] = future.result()
+            except Exception as e:
+                errors.append((str(jobs[n][1] if len(jobs[n]) > 1 else jobs[n][0]), str(e)))
+            if progress:
+                progress(done, len(jobs))
+    return results, errors
+
+def iter_main_photos(blobs_dir=BLOBS_DIR):
+    """Main (social) file of every blob, found with os.scandir."""
+    if not Path(blobs_dir).exists():
+        return
+    with os.scandir(blobs_dir) as prefix_dirs:
+        for prefix_dir in prefix_dirs:
+            if not prefix_dir.is_dir():
+                continue
+            with os.scandir(prefix_dir.path) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(PHOTO_EXTENSIONS):
+                        yield Path(entry.path)
+
+def reprocess_all(progress=None, max_workers=MAX_WORKERS):
+    """Regenerate the smaller derivatives of every photo from its main file."""
+    sizes = [size for size in PROFILES if size != MAIN_SIZE]
+    jobs = [(str(path), path, sizes) for path in iter_main_photos()]
+    return process_many(jobs, progress, max_workers)
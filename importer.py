@@ -0,0 +1,161 @@
+\
+"""
+Bulk photo import from a photo-shoot folder or ZIP.
+
+Files are mapped to SKUs by name (BH-2508-0001_1.jpg, "BH-2508-0001 frente.jpg")
+or, when the name has no SKU, by the QR label visible in the first shot of each
+item: every following file without a SKU goes to the last SKU named or read.
+
+    python importer.py /caminho/da/sessao [--loja principal] [--sem-qr]
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from db import fetchall, load_stores, STORE_ENV
+from images import PHOTO_EXTENSIONS, MAX_WORKERS, content_hash, open_reduced
+from manifest import save_photo_sets
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # QR mapping is optional
+    cv2 = None
+
+SKU_PATTERN = re.compile(r"BH-\d{4}-\d{4}", re.IGNORECASE)
+MAX_PHOTOS_PER_ITEM = 5
+# Side the label shot is decoded at (QR labels are small in a full-body photo)
+QR_DECODE_SIDE = 1600
+
+def list_sources(source, extract_dir):
+    """
+    (file name, file path) of every photo in a folder (recursive) or ZIP, by name.
+    ZIP members are extracted one at a time into extract_dir, so workers get
+    paths and no archive is held in memory.
+    """
+    source = Path(source)
+    files = []
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            for name in zf.namelist():
+                if name.lower().endswith(PHOTO_EXTENSIONS) and not name.startswith("__MACOSX"):
+                    files.append((name, zf.extract(name, extract_dir)))
+    else:
+        for root, _, names in os.walk(source):
+            files.extend((os.path.join(root, name), os.path.join(root, name))
+                         for name in names if name.lower().endswith(PHOTO_EXTENSIONS))
+    return sorted(files, key=lambda f: f[0])
+
+def read_qr_sku(src):
+    """Pool worker: SKU from a QR code in the photo, or None."""
+    with open_reduced(src, QR_DECODE_SIDE) as img:
+        gray = np.asarray(img.convert("L"))
+    text, _, _ = cv2.QRCodeDetector().detectAndDecode(gray)
+    m = SKU_PATTERN.search(text or "")
+    return m.group(0).upper() if m else None
+
+def _read_qr_many(srcs, max_workers=MAX_WORKERS):
+    if not srcs:
+        return []
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(srcs)),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(read_qr_sku, srcs))
+
+def map_files(files, use_qr=True):
+    """
+    Group files by SKU in shooting order. Returns ({sku: [(name, src)]}, unmatched names).
+    A SKU (from a file name or a label shot) carries over to the next files of
+    the same folder. Files after a named one are never decoded: QR codes are
+    only read where no named item is in progress.
+    """
+    names = [SKU_PATTERN.search(Path(name).name) for name, _ in files]
+    to_decode, current_dir, named = [], None, False
+    for n, ((name, _), m) in enumerate(zip(files, names)):
+        if Path(name).parent != current_dir:
+            current_dir, named = Path(name).parent, False
+        named = named or m is not None
+        if not named:
+            to_decode.append(n)
+    qr_skus = [None] * len(files)
+    if use_qr and cv2 is not None:
+        for n, sku in zip(to_decode, _read_qr_many([files[n][1] for n in to_decode])):
+            qr_skus[n] = sku
+    groups, unmatched = {}, []
+    current_sku, current_dir = None, None
+    for (name, src), m, qr_sku in zip(files, names, qr_skus):
+        if Path(name).parent != current_dir:
+            current_sku, current_dir = None, Path(name).parent
+        if m:
+            current_sku = m.group(0).upper()
+        else:
+            current_sku = qr_sku or current_sku
+        if current_sku:
+            groups.setdefault(current_sku, []).append((name, src))
+        else:
+            unmatched.append(name)
+    return groups, unmatched
+
+def import_photos(source, use_qr=True, progress=None) -> dict:
+    """
+    Import a folder or ZIP into the current store: map files to SKUs, process new
+    content in parallel and replace each SKU's photo set in one transaction.
+    Returns {skus, photos, unchanged, processed, reused, unmatched, unknown_skus, skipped, errors}.
+    """
+    with tempfile.TemporaryDirectory(prefix="brecho_import_") as extract_dir:
+        return _import_files(list_sources(source, extract_dir), use_qr, progress)
+
+def _import_files(files, use_qr, progress):
+    groups, unmatched = map_files(files, use_qr)
+    _, rows = fetchall("SELECT sku FROM items WHERE active = 1")
+    active = {r[0] for r in rows}
+    unknown = sorted(sku for sku in groups if sku not in active)
+
+    photo_sets, skipped = {}, []
+    for sku, entries in groups.items():
+        if sku not in active:
+            continue
+        skipped += [name for name, _ in entries[MAX_PHOTOS_PER_ITEM:]]
+        photo_sets[sku] = [(content_hash(Path(src).read_bytes()), src)
+                           for _, src in entries[:MAX_PHOTOS_PER_ITEM]]
+    result = save_photo_sets(photo_sets, progress)
+    return {"skus": len(result["skus"]), "photos": sum(len(photo_sets[sku]) for sku in result["skus"]),
+            "unchanged": len(photo_sets) - len(result["skus"]),
+            "processed": result["processed"], "reused": result["reused"],
+            "unmatched": unmatched, "unknown_skus": unknown, "skipped": skipped,
+            "errors": result["errors"]}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa fotos em lote de uma pasta ou ZIP.")
+    parser.add_argument("source", help="pasta ou arquivo .zip da sessão de fotos")
+    parser.add_argument("--loja", help="ID da loja (padrão: principal)")
+    parser.add_argument("--sem-qr", action="store_true", help="não ler QR das etiquetas")
+    args = parser.parse_args(argv)
+    if args.loja:
+        if args.loja not in load_stores():
+            parser.error(f"loja desconhecida: {args.loja}")
+        os.environ[STORE_ENV] = args.loja
+
+    def progress(done, total):
+        print(f"\rProcessando fotos... {done}/{total}", end="", file=sys.stderr)
+
+    result = import_photos(args.source, use_qr=not args.sem_qr, progress=progress)
+    print(file=sys.stderr)
+    print(f"{result['photos']} fotos em {result['skus']} itens "
+          f"({result['processed']} novas, {result['reused']} já existentes)")
+    for name in result["unmatched"]:
+        print(f"Sem SKU: {name}")
+    for sku in result["unknown_skus"]:
+        print(f"SKU não cadastrado ou inativo: {sku}")
+    for name in result["skipped"]:
+        print(f"Ignorada (máx. {MAX_PHOTOS_PER_ITEM} por item): {name}")
+    for path, message in result["errors"]:
+        print(f"Erro em {path}: {message}")
+    return 1 if result["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+\
+from db import get_conn, fetchall
+
+# Item row drawn by labels.label_values
+LABEL_COLUMNS = "sku, category, brand, size, condition, list_price, markdown_stage"
+
+def printed_values(row) -> tuple:
+    """(sku, list_price, markdown_stage) a label drawn from a LABEL_COLUMNS row shows."""
+    return row[0], row[5], row[6] or 0
+
+def record_prints(printed, target: str = "") -> int:
+    """
+    Record a print job once it is confirmed (sent to the printer or marked as
+    printed): the price and markdown stage each label showed, printed_values()
+    rows, go to label_prints in one statement and the job to label_jobs.
+    Returns the number of SKUs recorded.
+    """
+    with get_conn() as conn:
+        try:
+            conn.execute("CREATE TEMP TABLE job_labels (sku TEXT PRIMARY KEY, list_price REAL, markdown_stage INTEGER)")
+            conn.executemany("INSERT OR REPLACE INTO job_labels VALUES (?, ?, ?)", printed)
+            reprints = conn.execute("SELECT COUNT(*) FROM job_labels JOIN label_prints USING (sku)").fetchone()[0]
+            # WHERE true: SQLite needs it between INSERT ... SELECT and ON CONFLICT
+            count = conn.execute("""
+                INSERT INTO label_prints(sku, list_price, markdown_stage, printed_at, prints)
+                SELECT sku, list_price, markdown_stage, datetime('now'), 1
+                FROM job_labels WHERE true
+                ON CONFLICT(sku) DO UPDATE SET
+                    list_price = excluded.list_price,
+                    markdown_stage = excluded.markdown_stage,
+                    printed_at = excluded.printed_at,
+                    prints = prints + 1
+            """).rowcount
+            if count:
+                conn.execute("INSERT INTO label_jobs(labels, reprints, target) VALUES (?, ?, ?)",
+                             (count, reprints, target))
+        except Exception:
+            conn.rollback()
+            raise
+    return count
+
+def stale_query(stage: int = None):
+    """
+    (sql, params) of the items on sale whose printed tag shows another price
+    than today's (list price or markdown stage changed since), optionally only
+    those now at a markdown stage. label_prints is walked by its primary key and
+    each SKU looked up in items by its own; items never printed are left out.
+    """
+    sql = """
+        SELECT i.sku, i.category, i.brand, i.size, i.condition, i.list_price, i.markdown_stage
+        FROM label_prints p
+        JOIN items i ON i.sku = p.sku
+        WHERE i.active = 1 AND i.sold_at IS NULL
+          AND (i.list_price IS NOT p.list_price OR COALESCE(i.markdown_stage, 0) != p.markdown_stage)
+    """
+    params = []
+    if stage is not None:
+        sql += " AND COALESCE(i.markdown_stage, 0) = ?"
+        params.append(stage)
+    return sql + " ORDER BY p.sku", params
+
+def stale_by_stage():
+    """Stale label counts per current markdown stage."""
+    sql, params = stale_query()
+    return fetchall(f"""
+        SELECT COALESCE(markdown_stage, 0) AS stage, COUNT(*) AS qty
+        FROM ({sql}) GROUP BY stage ORDER BY stage
+    """, params)
+
+def print_history(limit: int = 10):
+    """Recent print jobs, newest first."""
+    return fetchall("""
+        SELECT printed_at, labels, reprints, target
+        FROM label_jobs
+        ORDER BY id DESC
+        LIMIT ?
+    """, (limit,))
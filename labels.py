@@ -0,0 +1,580 @@
+\
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from PIL import Image, ImageDraw
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen import canvas as pdf_canvas
+from fonts import get_font, pdf_font
+from images import MAX_WORKERS
+from qr_codes import QR_URL, qr_image, qr_matrix, qr_payload
+from utils import compute_markdown_price
+
+# Layouts are in pixels at 300 DPI; the PDF backend draws the same coordinates as vectors
+DPI = 300
+PT_PER_PX = 72 / DPI
+MM_PER_INCH = 25.4
+A4_SIZE = (2480, 3508)
+# Declarative layouts, in pixels at 300 DPI (label size in mm). A template is
+# compiled once per batch by render_plan(); every label then only fills the plan.
+#   size_mm or sheet (cols, rows, gap on an A4 page), margin, border (line width)
+#   qr: size and position ("left", vertically centred, or "top_right"); the code
+#       holds the SKU, or the qr_url option with it (qr_codes.qr_payload)
+#   top: lines stacked down from the top margin, beside the QR
+#   bottom: lines stacked up from the bottom edge, across the whole label
+# Line keys: field, size, advance (height the line takes), lines (word-wrap over
+# up to n lines), fit (shrink down to min_size to fit the width), align
+# ("left"/"center"), fill, markdown_fill (colour when discounted), strike, weight.
+# A line whose element is switched off in the options takes no space.
+_PRICE = {"field": "price", "markdown_fill": "red", "fit": True}
+_ORIGINAL = {"field": "original_price", "fill": "gray", "strike": True}
+TEMPLATES = {
+    "58x40mm (Térmica pequena)": {
+        "size_mm": (58, 40), "margin": 10,
+        # 120 px: a SKU code at 3+ dots per module on 203-DPI printers (printers.MIN_QR_MODULE_DOTS)
+        "qr": {"size": 120, "at": "left"},
+        "top": [
+            {"field": "sku", "size": 16, "advance": 25},
+            {"field": "description", "size": 12, "advance": 20, "lines": 2},
+            {"field": "condition", "size": 12, "advance": 20},
+            {**_PRICE, "size": 20, "advance": 25},
+            {**_ORIGINAL, "size": 12, "advance": 20},
+            {"field": "store", "size": 12, "advance": 20, "fit": True},
+        ],
+    },
+    "70x50mm (Térmica padrão)": {
+        "size_mm": (70, 50), "margin": 10,
+        "qr": {"size": 120, "at": "left"},
+        "top": [
+            {"field": "sku", "size": 20, "advance": 30},
+            {"field": "description", "size": 16, "advance": 25, "lines": 2},
+            {"field": "condition", "size": 16, "advance": 25},
+            {**_PRICE, "size": 28, "advance": 30},
+            {**_ORIGINAL, "size": 16, "advance": 25},
+            {"field": "store", "size": 16, "advance": 25, "fit": True},
+        ],
+    },
+    "90x60mm (Etiqueta grande)": {
+        "size_mm": (90, 60), "margin": 12,
+        "qr": {"size": 160, "at": "left"},
+        "top": [
+            {"field": "sku", "size": 24, "advance": 36},
+            {"field": "description", "size": 20, "advance": 30, "lines": 2},
+            {"field": "condition", "size": 20, "advance": 30},
+            {**_PRICE, "size": 36, "advance": 40, "weight": "bold"},
+            {**_ORIGINAL, "size": 20, "advance": 30},
+            {"field": "store", "size": 18, "advance": 28, "fit": True},
+        ],
+    },
+    "A4 - Grade 2x4 (8 etiquetas)": {
+        "sheet": (2, 4, 40), "margin": 8, "border": 2,
+        "qr": {"size": 60, "at": "top_right"},
+        "top": [
+            {"field": "sku", "size": 18, "advance": 25},
+            {"field": "description", "size": 14, "advance": 20, "lines": 2},
+            {"field": "condition", "size": 14, "advance": 20},
+            {"field": "store", "size": 14, "advance": 20, "fit": True},
+        ],
+        "bottom": [
+            {**_PRICE, "size": 24, "advance": 35, "align": "center"},
+            {**_ORIGINAL, "size": 14, "advance": 18, "align": "center"},
+        ],
+    },
+    "A4 - Grade 3x6 (18 etiquetas)": {
+        "sheet": (3, 6, 30), "margin": 8, "border": 2,
+        "qr": {"size": 60, "at": "top_right"},
+        "top": [
+            {"field": "sku", "size": 18, "advance": 25},
+            {"field": "description", "size": 14, "advance": 20, "lines": 2},
+            {"field": "condition", "size": 14, "advance": 20},
+            {"field": "store", "size": 14, "advance": 20, "fit": True},
+        ],
+        "bottom": [
+            {**_PRICE, "size": 24, "advance": 35, "align": "center"},
+            {**_ORIGINAL, "size": 14, "advance": 18, "align": "center"},
+        ],
+    },
+}
+# Custom sizes scale this template to the requested label
+CUSTOM_FORMAT = "Personalizado (mm)"
+CUSTOM_BASE = "70x50mm (Térmica padrão)"
+LABEL_FORMATS = list(TEMPLATES) + [CUSTOM_FORMAT]
+# Element switches (page "Configurações de Etiqueta") and the fields they hide
+DEFAULT_OPTIONS = {"qr": True, "condition": True, "original_price": True, "store_info": False,
+                   "store_name": "Brechó", "store_contact": "", "qr_url": QR_URL}
+FIELD_OPTIONS = {"condition": "condition", "original_price": "original_price", "store": "store_info"}
+# A4 sheets are previewed at a third of print resolution (~3 MB instead of ~26 MB)
+PREVIEW_SCALE = 1 / 3
+PROGRESS_EVERY = 25
+# Batches from POOL_MIN_LABELS up are laid out in a process pool, POOL_WINDOW labels in flight
+POOL_MIN_LABELS = 100
+POOL_WINDOW = 400
+POOL_CHUNK = 25
+# Dash length (pixels) of struck-through prices on 1-bit labels
+MONO_DASH = 6
+# Generated label files, named by batch_key(); shared by sessions, pruned by age
+LABEL_CACHE_DIR = Path(tempfile.gettempdir()) / "brecho_labels"
+LABEL_CACHE_MAX_AGE = 24 * 3600
+
+class RasterSurface:
+    """
+    Pillow drawing surface in label pixels, optionally scaled down for previews.
+    QR modules are snapped to whole pixels. mono: 1-bit image (mode "1", 1/24
+    of the RGB memory) for thermal printers: text without anti-aliasing and
+    colour accents turned into black ink, with struck-through prices as a dashed bar.
+    """
+
+    def __init__(self, width: int, height: int, scale: float = 1.0, mono: bool = False):
+        self.scale = scale
+        self.mono = mono
+        size = (round(width * scale), round(height * scale))
+        self.image = Image.new("1", size, 1) if mono else Image.new("RGB", size, "white")
+        self.draw = ImageDraw.Draw(self.image)
+        if mono:
+            self.draw.fontmode = "1"
+        self.origin = (0, 0)
+
+    def _xy(self, x, y):
+        return round((self.origin[0] + x) * self.scale), round((self.origin[1] + y) * self.scale)
+
+    def _font(self, size, weight="regular"):
+        return get_font(max(1, round(size * self.scale)), weight)
+
+    def _ink(self, fill):
+        return 0 if self.mono else fill
+
+    def text(self, x, y, text, size, fill="black", weight="regular"):
+        self.draw.text(self._xy(x, y), text, fill=self._ink(fill), font=self._font(size, weight))
+
+    def text_width(self, text, size, weight="regular") -> float:
+        bbox = self.draw.textbbox((0, 0), text, font=self._font(size, weight))
+        return (bbox[2] - bbox[0]) / self.scale
+
+    def line(self, x1, y1, x2, y2, fill="black", width=1):
+        width = max(1, round(width * self.scale))
+        (x1, y1), (x2, y2) = self._xy(x1, y1), self._xy(x2, y2)
+        if not self.mono or fill == "black" or y1 != y2:
+            self.draw.line([(x1, y1), (x2, y2)], fill=self._ink(fill), width=width)
+            return
+        # A grey strikethrough would vanish on a thermal head: dashed double-weight bar instead
+        for start in range(min(x1, x2), max(x1, x2), 2 * MONO_DASH):
+            self.draw.rectangle([(start, y1 - width), (min(start + MONO_DASH, max(x1, x2)) - 1, y1 + width - 1)], fill=0)
+
+    def border(self, width, height, line_width=2):
+        x, y = self._xy(0, 0)
+        x2, y2 = self._xy(width, height)
+        self.draw.rectangle([(x, y), (x2 - 1, y2 - 1)], outline=self._ink("black"),
+                            width=max(1, round(line_width * self.scale)))
+
+    def qr(self, x, y, size, data):
+        # Whole-pixel modules, centred in the box: no resampling blur (or grey to threshold)
+        side = round(size * self.scale)
+        code = qr_image(data, max(1, side // len(qr_matrix(data))))
+        px, py = self._xy(x, y)
+        offset = (side - code.width) // 2
+        self.image.paste(code, (px + offset, py + offset))
+
+class PdfSurface:
+    """reportlab drawing surface taking the same top-left pixel coordinates as RasterSurface."""
+
+    def __init__(self, canvas, page_height: int):
+        self.canvas = canvas
+        self.page_height = page_height
+        self.origin = (0, 0)
+
+    def _xy(self, x, y):
+        return (self.origin[0] + x) * PT_PER_PX, (self.page_height - self.origin[1] - y) * PT_PER_PX
+
+    def text(self, x, y, text, size, fill="black", weight="regular"):
+        # Pillow places the ascender line at y; reportlab draws from the baseline
+        font, pt = pdf_font(weight), size * PT_PER_PX
+        px, py = self._xy(x, y)
+        self.canvas.setFillColor(fill)
+        self.canvas.setFont(font, pt)
+        self.canvas.drawString(px, py - pdfmetrics.getAscent(font, pt), text)
+
+    def text_width(self, text, size, weight="regular") -> float:
+        return pdfmetrics.stringWidth(text, pdf_font(weight), size * PT_PER_PX) / PT_PER_PX
+
+    def line(self, x1, y1, x2, y2, fill="black", width=1):
+        self.canvas.setStrokeColor(fill)
+        self.canvas.setLineWidth(width * PT_PER_PX)
+        self.canvas.line(*self._xy(x1, y1), *self._xy(x2, y2))
+
+    def border(self, width, height, line_width=2):
+        self.canvas.setStrokeColor("black")
+        self.canvas.setLineWidth(line_width * PT_PER_PX)
+        x, y = self._xy(0, height)
+        self.canvas.rect(x, y, width * PT_PER_PX, height * PT_PER_PX, stroke=1, fill=0)
+
+    def _qr_literal(self, x, y, size, data) -> str:
+        # Raw PDF operators, one rectangle per horizontal run of dark modules,
+        # filled black inside q/Q so the canvas' own colour state is untouched
+        matrix = qr_matrix(data)
+        module = size / len(matrix)
+        side = module * PT_PER_PX
+        ops = ["q 0 g"]
+        for r, row in enumerate(matrix):
+            c = 0
+            while c < len(row):
+                if not row[c]:
+                    c += 1
+                    continue
+                start = c
+                while c < len(row) and row[c]:
+                    c += 1
+                px, py = self._xy(x + start * module, y + (r + 1) * module)
+                ops.append(f"{px:.3f} {py:.3f} {(c - start) * side:.3f} {side:.3f} re")
+        ops.append("f Q")
+        return "\n".join(ops)
+
+    def qr(self, x, y, size, data):
+        self.canvas.addLiteral(self._qr_literal(x, y, size, data))
+
+    def replay(self, ops):
+        """Draw the operations recorded by a RecordingSurface."""
+        for origin, name, args, kwargs in ops:
+            self.origin = origin
+            if name == "literal":
+                self.canvas.addLiteral(*args)
+            else:
+                getattr(self, name)(*args, **kwargs)
+
+class RecordingSurface(PdfSurface):
+    """
+    PdfSurface that records drawing calls instead of drawing, so labels can be
+    laid out (QR encoding, text metrics) in pool workers and replayed in order.
+    """
+
+    def __init__(self, page_height: int):
+        super().__init__(None, page_height)
+        self.ops = []
+
+    def text(self, *args, **kwargs):
+        self.ops.append((self.origin, "text", args, kwargs))
+
+    def line(self, *args, **kwargs):
+        self.ops.append((self.origin, "line", args, kwargs))
+
+    def border(self, *args, **kwargs):
+        self.ops.append((self.origin, "border", args, kwargs))
+
+    def qr(self, x, y, size, data):
+        self.ops.append((self.origin, "literal", (self._qr_literal(x, y, size, data),), {}))
+
+def mm_to_px(mm: float) -> int:
+    return round(mm / MM_PER_INCH * DPI)
+
+def custom_template(width_mm: float, height_mm: float) -> dict:
+    """CUSTOM_BASE scaled to a label of any size."""
+    base = TEMPLATES[CUSTOM_BASE]
+    k = min(width_mm / base["size_mm"][0], height_mm / base["size_mm"][1])
+    scale = lambda v: max(1, round(v * k))
+    return {
+        **base, "size_mm": (width_mm, height_mm), "margin": scale(base["margin"]),
+        "qr": {**base["qr"], "size": scale(base["qr"]["size"])},
+        "top": [{**line, "size": scale(line["size"]), "advance": scale(line["advance"])} for line in base["top"]],
+    }
+
+def _text_op(line, x, y, width, static_text=None) -> dict:
+    return {
+        "field": line["field"], "text": static_text, "x": x, "y": y, "width": width,
+        "size": line["size"], "min_size": line.get("min_size", max(6, line["size"] * 2 // 3)),
+        "advance": line["advance"], "lines": line.get("lines", 1), "fit": line.get("fit", False),
+        "align": line.get("align", "left"), "fill": line.get("fill", "black"),
+        "markdown_fill": line.get("markdown_fill"), "strike": line.get("strike", False),
+        "weight": line.get("weight", "regular"),
+    }
+
+def render_plan(template: dict, options: dict = None) -> dict:
+    """
+    Compile a template with the element options into a render plan: page and
+    label size, cell origins on the page, QR box and positioned text slots.
+    The plan is plain data, so pool workers receive it as is.
+    """
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    if "sheet" in template:
+        cols, rows, gap = template["sheet"]
+        page = A4_SIZE
+        width = (page[0] - (cols + 1) * gap) // cols
+        height = (page[1] - (rows + 1) * gap) // rows
+        cells = [(gap + col * (width + gap), gap + row * (height + gap)) for row in range(rows) for col in range(cols)]
+    else:
+        width, height = page = tuple(mm_to_px(v) for v in template["size_mm"])
+        cells = [(0, 0)]
+    margin = template["margin"]
+    store_text = " · ".join(v for v in (options["store_name"], options["store_contact"]) if v)
+
+    qr_box, text_x, text_right = None, margin, width - margin
+    if options["qr"] and template.get("qr"):
+        size = template["qr"]["size"]
+        if template["qr"]["at"] == "left":
+            qr_box = (margin, (height - size) // 2, size)
+            text_x = 2 * margin + size
+        else:
+            qr_box = (width - size - margin, margin, size)
+            text_right = width - size - 2 * margin
+
+    def enabled(line):
+        option = FIELD_OPTIONS.get(line["field"])
+        return not option or options[option]
+
+    texts, y = [], margin
+    for line in filter(enabled, template.get("top", [])):
+        texts.append(_text_op(line, text_x, y, text_right - text_x, store_text if line["field"] == "store" else None))
+        y += line["advance"] * line.get("lines", 1)
+    y = height
+    for line in filter(enabled, template.get("bottom", [])):
+        y -= line["advance"] * line.get("lines", 1)
+        texts.append(_text_op(line, margin, y, width - 2 * margin, store_text if line["field"] == "store" else None))
+    return {"page": page, "label": (width, height), "cells": cells, "border": template.get("border", 0),
+            "qr": qr_box, "qr_url": options["qr_url"], "texts": texts}
+
+def label_values(item) -> dict:
+    """Text of each field for an item row (sku, category, brand, size, condition, list_price, markdown_stage)."""
+    sku, category, brand, size, condition, list_price, markdown_stage = item
+    markdown_stage = markdown_stage or 0
+    list_price = list_price or 0.0
+    current_price = compute_markdown_price(list_price, markdown_stage)
+    return {
+        "sku": sku,
+        "description": " ".join(str(v) for v in (category, brand, size) if v),
+        "condition": f"Estado: {condition}" if condition else "",
+        "price": f"R$ {current_price:.2f}",
+        "original_price": f"(R$ {list_price:.2f})" if markdown_stage > 0 else "",
+        "markdown": markdown_stage > 0,
+    }
+
+def _wrap(surface, text, size, weight, width, max_lines):
+    """Greedy word wrap over at most max_lines lines (the last one takes the rest)."""
+    lines, current = [], ""
+    for word in text.split():
+        candidate = f"{current} {word}".strip()
+        if current and len(lines) < max_lines - 1 and surface.text_width(candidate, size, weight) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    return lines + [current]
+
+def _draw_text(surface, op, text, markdown):
+    if not text:
+        return
+    size, weight = op["size"], op["weight"]
+    if op["lines"] > 1:
+        lines = _wrap(surface, text, size, weight, op["width"], op["lines"])
+    else:
+        lines = [text]
+        if op["fit"]:
+            while size > op["min_size"] and surface.text_width(text, size, weight) > op["width"]:
+                size -= 1
+    fill = op["markdown_fill"] if markdown and op["markdown_fill"] else op["fill"]
+    for n, line in enumerate(lines):
+        x, y = op["x"], op["y"] + n * op["advance"]
+        if op["align"] == "center" or op["strike"]:
+            line_width = surface.text_width(line, size, weight)
+            if op["align"] == "center":
+                x += (op["width"] - line_width) // 2
+        surface.text(x, y, line, size, fill=fill, weight=weight)
+        if op["strike"]:
+            strike_y = y + size * 0.6
+            surface.line(x, strike_y, x + line_width, strike_y, fill=fill)
+
+def fill_label(surface, plan, item, slot: int = 0):
+    """Draw one item with a render plan, in cell slot of the page."""
+    surface.origin = plan["cells"][slot]
+    values = label_values(item)
+    if plan["border"]:
+        surface.border(*plan["label"], plan["border"])
+    if plan["qr"]:
+        surface.qr(*plan["qr"], qr_payload(values["sku"], plan["qr_url"]))
+    for op in plan["texts"]:
+        _draw_text(surface, op, op["text"] or values[op["field"]], values["markdown"])
+
+def labels_per_page(plan) -> int:
+    return len(plan["cells"])
+
+def render_label(item, plan, scale: float = 1.0, mono: bool = False) -> Image.Image:
+    """Raster image of one label (1-bit with mono)."""
+    surface = RasterSurface(*plan["label"], scale, mono)
+    fill_label(surface, {**plan, "cells": [(0, 0)]}, item)
+    return surface.image
+
+def render_sheet(items, plan, scale: float = PREVIEW_SCALE) -> Image.Image:
+    """Raster preview of the first page of a sheet format."""
+    surface = RasterSurface(*plan["page"], scale)
+    for slot, item in enumerate(items[:labels_per_page(plan)]):
+        fill_label(surface, plan, item, slot)
+    return surface.image
+
+def render_preview(items, plan, mono: bool = False) -> Image.Image:
+    """Preview image for the first label (thermal) or first sheet (A4) of a batch."""
+    if labels_per_page(plan) > 1:
+        return render_sheet(items, plan)
+    return render_label(items[0], plan, mono=mono)
+
+def record_label(plan, item, slot):
+    """Pool worker: drawing operations of one label at its slot on the page."""
+    surface = RecordingSurface(plan["page"][1])
+    fill_label(surface, plan, item, slot)
+    return surface.ops
+
+def label_png(plan, item, slot=0) -> bytes:
+    """Pool worker: one label as a 1-bit PNG at print resolution."""
+    buf = io.BytesIO()
+    render_label(item, plan, mono=True).save(buf, format="PNG", optimize=True, dpi=(DPI, DPI))
+    return buf.getvalue()
+
+def _sku_png(plan, item, slot=0):
+    return item[0], label_png(plan, item, slot)
+
+def _map_labels(worker, items, plan, workers):
+    """worker(plan, item, slot) for every label, results in order; POOL_WINDOW labels at a time."""
+    per_page = labels_per_page(plan)
+    jobs = ((item, n % per_page) for n, item in enumerate(items))
+    task = partial(worker, plan)
+    if workers <= 1:
+        yield from (task(item, slot) for item, slot in jobs)
+        return
+    # spawn: never fork the (multi-threaded) Streamlit server
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = None
+        while True:
+            # Queue the next window before draining the current one to keep workers busy
+            window = list(islice(jobs, POOL_WINDOW))
+            queued = pool.map(task, *zip(*window), chunksize=POOL_CHUNK) if window else None
+            if pending is not None:
+                yield from pending
+            if queued is None:
+                break
+            pending = queued
+
+def write_labels_pdf(items, plan, out, total: int = None, progress=None,
+                     max_workers: int = MAX_WORKERS) -> int:
+    """
+    Vector PDF of any number of labels to a path or file object: one page per
+    label (page = label size) or sheets filled row by row, as many as the
+    items need. items may be any iterable (e.g. db.iter_rows), consumed
+    once; pages are compressed as they are closed. Batches of POOL_MIN_LABELS
+    or more (per total) are laid out in a process pool and drawn in order.
+    Returns the label count.
+    """
+    page_width, page_height = plan["page"]
+    c = pdf_canvas.Canvas(out, pagesize=(page_width * PT_PER_PX, page_height * PT_PER_PX), pageCompression=1)
+    c.setTitle("Etiquetas")
+    surface = PdfSurface(c, page_height)
+    per_page = labels_per_page(plan)
+    workers = max_workers if total and total >= POOL_MIN_LABELS else 1
+    n = 0
+    for n, ops in enumerate(_map_labels(record_label, items, plan, workers), 1):
+        if n > 1 and (n - 1) % per_page == 0:
+            c.showPage()
+        surface.replay(ops)
+        if progress and (n % PROGRESS_EVERY == 0 or n == total):
+            progress(n, total)
+    c.showPage()
+    c.save()
+    return n
+
+def write_labels_png_zip(items, plan, out, total: int = None, progress=None,
+                         max_workers: int = MAX_WORKERS) -> int:
+    """
+    ZIP of 1-bit PNG labels (etiqueta_0001_<sku>.png, in order) to a path or file
+    object, for printers driven through their image driver. Sheet plans are not
+    supported. Returns the label count.
+    """
+    if labels_per_page(plan) > 1:
+        raise ValueError("Folhas A4 saem em PDF; escolha um formato de etiqueta para PNG.")
+    workers = max_workers if total and total >= POOL_MIN_LABELS else 1
+    n = 0
+    # PNG is already compressed: store the entries as they are
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_STORED) as zf:
+        for n, (sku, png) in enumerate(_map_labels(_sku_png, items, plan, workers), 1):
+            zf.writestr(f"etiqueta_{n:04d}_{sku}.png", png)
+            if progress and (n % PROGRESS_EVERY == 0 or n == total):
+                progress(n, total)
+    return n
+
+def labels_pdf(items, plan) -> bytes:
+    """In-memory PDF for a handful of labels."""
+    buf = io.BytesIO()
+    write_labels_pdf(items, plan, buf)
+    return buf.getvalue()
+
+class BatchKey:
+    """
+    Content hash of a batch, taken while its rows stream past: the item rows
+    (prices and markdown stages included), the compiled plan and the output
+    variant (format, DPI). count is the number of rows seen.
+    """
+
+    def __init__(self, plan, *variant):
+        self._hash = hashlib.sha256(repr((plan, variant)).encode())
+        self.count = 0
+
+    def rows(self, items):
+        """items, passed through and hashed as they are read."""
+        for item in items:
+            self._hash.update(repr(tuple(item)).encode())
+            self.count += 1
+            yield item
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+def batch_key(items, plan, *variant) -> str:
+    """BatchKey of a whole batch: one pass over items, no rendering."""
+    key = BatchKey(plan, *variant)
+    for _ in key.rows(items):
+        pass
+    return key.hexdigest()
+
+def cached_label_file(key: str, extension: str, write, written_key=None) -> tuple:
+    """
+    Path of the label file for a batch key, calling write(out) to produce it
+    only when it is not cached yet (written to a temp file, then renamed).
+    written_key() gives the key of the rows write actually rendered: when the
+    rows changed since key was computed, the file keeps a one-off name instead
+    of being cached under a key that does not match its content.
+    Returns (path, True when it came from the cache).
+    """
+    LABEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = LABEL_CACHE_DIR / f"{key}.{extension}"
+    if path.exists():
+        os.utime(path)
+        return path, True
+    prune_label_cache()
+    fd, tmp = tempfile.mkstemp(dir=LABEL_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            write(out)
+        if written_key and written_key() != key:
+            path = Path(tmp).with_suffix(f".{extension}")
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return path, False
+
+def prune_label_cache(max_age: float = LABEL_CACHE_MAX_AGE) -> int:
+    """Delete label files not used for max_age seconds. Returns how many."""
+    cutoff = time.time() - max_age
+    removed = 0
+    if LABEL_CACHE_DIR.is_dir():
+        with os.scandir(LABEL_CACHE_DIR) as entries:
+            stale = [entry.path for entry in entries if entry.is_file() and entry.stat().st_mtime <= cutoff]
+        for path in stale:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
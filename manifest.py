@@ -0,0 +1,294 @@
+\
+import os
+import re
+from pathlib import Path
+from db import get_conn, fetchall, update_fields_many
+from images import (PHOTOS_DIR, BLOBS_DIR, QUARANTINE_DIR, PHOTO_EXTENSIONS, PROFILES, MAIN_SIZE,
+                    content_hash, blob_path, variant_path, file_info, process_many, compression_report, photo_features)
+
+DERIVED_SIZES = [size for size in PROFILES if size != MAIN_SIZE]
+
+def photo_position(path) -> int:
+    """Position encoded in a legacy file name (<SKU>_<n>.<ext>), 0 if missing."""
+    m = re.search(r"_(\d+)$", Path(path).stem)
+    return int(m.group(1)) if m else 0
+
+def sku_photos(sku: str):
+    _, rows = fetchall("SELECT file_path FROM photos WHERE sku = ? ORDER BY position", (sku,))
+    return [Path(r[0]) for r in rows]
+
+def insert_blobs(conn, blobs):
+    """blobs: [(hash, file_info dict)]"""
+    conn.executemany("""
+        INSERT INTO photo_blobs(hash, file_path, width, height, bytes, phash, color)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(hash) DO UPDATE SET
+            file_path=excluded.file_path, width=excluded.width,
+            height=excluded.height, bytes=excluded.bytes,
+            phash=COALESCE(excluded.phash, photo_blobs.phash),
+            color=COALESCE(excluded.color, photo_blobs.color)
+    """, [(digest, info["file_path"], info["width"], info["height"], info["bytes"],
+           info.get("phash"), info.get("color"))
+          for digest, info in blobs])
+
+def link_photo(conn, sku, position, digest):
+    conn.execute("""
+        INSERT INTO photos(sku, position, file_path, width, height, bytes, hash)
+        SELECT ?, ?, file_path, width, height, bytes, hash FROM photo_blobs WHERE hash = ?
+        ON CONFLICT(sku, position) DO UPDATE SET
+            file_path=excluded.file_path, width=excluded.width, height=excluded.height,
+            bytes=excluded.bytes, hash=excluded.hash, created_at=datetime('now')
+    """, (sku, position, digest))
+
+def unquarantine_blob(digest: str):
+    """
+    Move a blob file (and its derivatives) back from the newest quarantine folder
+    holding it. Returns its file_info, or None when it is not in quarantine.
+    """
+    found = sorted(QUARANTINE_DIR.glob(f"*/{digest[:2]}/{digest}.*"))
+    if not found:
+        return None
+    date_root = found[-1].parent.parent
+    for size in PROFILES:
+        source = variant_path(found[-1], size)
+        if source.exists():
+            target = BLOBS_DIR / source.relative_to(date_root)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(source, target)
+    return file_info(BLOBS_DIR / found[-1].relative_to(date_root))
+
+def _claim_known_blobs(conn, digests):
+    """
+    Inside the linking transaction, make sure blobs found in the manifest earlier
+    still have their file: cleanup.quarantine_step may have moved an unreferenced
+    one since. Present files are touched (the cleanup skips recent files), moved
+    ones are brought back. Returns ([(hash, file_info)] restored, hashes lost).
+    """
+    restored, lost = [], set()
+    for digest in digests:
+        row = conn.execute("SELECT file_path FROM photo_blobs WHERE hash = ?", (digest,)).fetchone()
+        if row and os.path.exists(row[0]):
+            os.utime(row[0])
+            continue
+        info = unquarantine_blob(digest)
+        if info:
+            restored.append((digest, info))
+        else:
+            lost.add(digest)
+    return restored, lost
+
+def save_uploads(sku: str, uploads, progress=None) -> dict:
+    """
+    Store uploaded photos [(file name, bytes)] as the SKU's photo set, in order.
+    Only content not yet in the blob store is processed; uploading the same set
+    again is a no-op, and a smaller set drops the SKU's extra links.
+    """
+    result = save_photo_sets({sku: [(content_hash(data), data) for name, data in uploads]}, progress)
+    result["unchanged"] = not result["skus"]
+    return result
+
+def save_photo_sets(photo_sets, progress=None) -> dict:
+    """
+    Store several SKUs' photo sets at once: {sku: [(hash, bytes or file path)]}.
+    New content is processed in one pool run, then every SKU's links (and its
+    items.photos_url) are replaced in a single transaction. SKUs whose set is
+    unchanged are skipped. Items without a colour get the first photo's.
+    Returns {skus, processed, reused, errors, compression}.
+    """
+    placeholders = ",".join("?" * len(photo_sets))
+    _, rows = fetchall(f"SELECT sku, hash FROM photos WHERE sku IN ({placeholders}) ORDER BY sku, position",
+                       list(photo_sets))
+    current = {}
+    for sku, digest in rows:
+        current.setdefault(sku, []).append(digest)
+    photo_sets = {sku: entries for sku, entries in photo_sets.items()
+                  if current.get(sku, []) != [digest for digest, _ in entries]}
+    sources = {digest: src for entries in photo_sets.values() for digest, src in entries}
+    if not sources:
+        return {"skus": [], "processed": 0, "reused": 0, "errors": [], "compression": []}
+
+    placeholders = ",".join("?" * len(sources))
+    _, rows = fetchall(f"SELECT hash FROM photo_blobs WHERE hash IN ({placeholders})", list(sources))
+    known = {r[0] for r in rows}
+    job_hashes = [digest for digest in sources if digest not in known]
+    jobs = [(sources[digest], blob_path(digest)) for digest in job_hashes]
+
+    results, errors = process_many(jobs, progress)
+    new_blobs = [(digest, info) for digest, info in zip(job_hashes, results) if info]
+    failed = {digest for digest, info in zip(job_hashes, results) if not info}
+
+    with get_conn() as conn:
+        # Write lock first: the cleanup's photo_blobs deletes wait for this transaction
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            restored, lost = _claim_known_blobs(conn, [digest for digest in sources if digest in known])
+            errors += [(str(blob_path(digest)), "arquivo não encontrado") for digest in lost]
+            failed |= lost
+            insert_blobs(conn, new_blobs + restored)
+            for sku, entries in photo_sets.items():
+                linked = [digest for digest, _ in entries if digest not in failed]
+                conn.execute("DELETE FROM photos WHERE sku = ?", (sku,))
+                for position, digest in enumerate(linked, 1):
+                    link_photo(conn, sku, position, digest)
+            placeholders = ",".join("?" * len(photo_sets))
+            first = dict(conn.execute(f"SELECT sku, file_path FROM photos WHERE position = 1 AND sku IN ({placeholders})",
+                                      list(photo_sets)).fetchall())
+            update_fields_many("items", "sku", [{"sku": sku, "photos_url": first.get(sku, "")} for sku in photo_sets],
+                               conn)
+            fill_item_colors(conn, list(photo_sets))
+        except Exception:
+            conn.rollback()
+            raise
+    return {"skus": list(photo_sets), "processed": len(new_blobs),
+            "reused": len(set(sources) - failed) - len(new_blobs), "errors": errors,
+            "compression": compression_report(results)}
+
+def _scan_blobs():
+    """Main blob files ({path: size}) and the set of derivative paths, via os.scandir."""
+    main, derivatives = {}, set()
+    if not BLOBS_DIR.exists():
+        return main, derivatives
+    with os.scandir(BLOBS_DIR) as prefix_dirs:
+        for prefix_dir in prefix_dirs:
+            if not prefix_dir.is_dir():
+                continue
+            with os.scandir(prefix_dir.path) as entries:
+                for entry in entries:
+                    if entry.is_dir() and entry.name in PROFILES:
+                        with os.scandir(entry.path) as variants:
+                            derivatives.update(v.path for v in variants)
+                    elif entry.is_file() and entry.name.lower().endswith(PHOTO_EXTENSIONS):
+                        main[entry.path] = entry.stat().st_size
+    return main, derivatives
+
+def _remove_blob_files(path) -> int:
+    """Delete a photo file and its derivatives, returning the bytes freed."""
+    freed = 0
+    for size in PROFILES:
+        variant = variant_path(path, size)
+        try:
+            freed += os.stat(variant).st_size
+            os.remove(variant)
+        except FileNotFoundError:
+            pass
+    return freed
+
+def migrate_legacy(store_id: str = None) -> int:
+    """
+    Move the store's legacy per-SKU photo folders into the blob store; run at app
+    startup so existing databases show their photos without a manual sync.
+    Legacy files are already-resized outputs, so their blobs are keyed by the
+    hash of the resized file: re-uploading an original of such a photo stores it
+    again (the legacy blob is then unreferenced and goes with the cleanup job).
+    Returns the number of files migrated.
+    """
+    if not PHOTOS_DIR.exists():
+        return 0
+    with get_conn(store_id) as conn:
+        store_skus = {r[0] for r in conn.execute("SELECT sku FROM items")}
+    return _migrate_legacy(store_skus, store_id)
+
+def _migrate_legacy(store_skus, store_id: str = None) -> int:
+    """Move photos/<SKU>/<SKU>_<n>.<ext> files (and derivatives) into the blob store."""
+    with get_conn(store_id) as conn:
+        rows = conn.execute("SELECT DISTINCT sku FROM photos WHERE file_path LIKE ?", (f"{BLOBS_DIR}%",)).fetchall()
+    skus_with_blobs = {r[0] for r in rows}
+    migrated = 0
+    with os.scandir(PHOTOS_DIR) as sku_dirs:
+        sku_entries = [e for e in sku_dirs
+                       if e.is_dir() and e.path not in (str(BLOBS_DIR), str(QUARANTINE_DIR))]
+    for sku_dir in sku_entries:
+        sku = sku_dir.name
+        if sku not in store_skus:
+            continue
+        with os.scandir(sku_dir.path) as entries:
+            files = sorted(e.path for e in entries
+                           if e.is_file() and e.name.lower().endswith(PHOTO_EXTENSIONS))
+        blobs, links = [], []
+        for path in files:
+            info = file_info(path)
+            target = blob_path(info["hash"]).with_suffix(Path(path).suffix.lower())
+            if target.exists():
+                _remove_blob_files(path)
+            else:
+                for size in PROFILES:
+                    variant = variant_path(path, size)
+                    if variant.exists():
+                        variant_path(target, size).parent.mkdir(parents=True, exist_ok=True)
+                        os.replace(variant, variant_path(target, size))
+            info["file_path"] = str(target)
+            blobs.append((info["hash"], info))
+            links.append((photo_position(path), info["hash"]))
+            migrated += 1
+        with get_conn(store_id) as conn:
+            insert_blobs(conn, blobs)
+            # SKUs re-uploaded since the blob store exists keep their current set
+            if sku not in skus_with_blobs:
+                for position, digest in links:
+                    link_photo(conn, sku, position, digest)
+        for size in DERIVED_SIZES:
+            try:
+                os.rmdir(Path(sku_dir.path) / size)
+            except OSError:
+                pass
+        try:
+            os.rmdir(sku_dir.path)
+        except OSError:
+            pass
+    return migrated
+
+def reconcile(progress=None):
+    """
+    Sync the manifest with photos/: migrate legacy per-SKU folders into the blob
+    store, drop rows whose file is gone, regenerate missing derivatives and
+    compute missing perceptual hashes.
+    Returns a dict with migrated, removed, regenerated and hashed counts.
+    """
+    # Only folders of this store's items go into its manifest
+    migrated = migrate_legacy()
+
+    on_disk, derivatives = _scan_blobs()
+    _, rows = fetchall("SELECT sku, position, file_path FROM photos")
+    removed = [(sku, pos) for sku, pos, file_path in rows if file_path not in on_disk]
+    _, rows = fetchall("SELECT hash, file_path FROM photo_blobs")
+    missing_blobs = [(digest,) for digest, file_path in rows if file_path not in on_disk]
+    with get_conn() as conn:
+        conn.executemany("DELETE FROM photos WHERE sku = ? AND position = ?", removed)
+        conn.executemany("DELETE FROM photo_blobs WHERE hash = ?", missing_blobs)
+
+    # Derivatives missing for some blob (e.g. photos uploaded before they existed)
+    missing = [(file_path, file_path, DERIVED_SIZES) for file_path in on_disk
+               if any(str(variant_path(file_path, size)) not in derivatives for size in DERIVED_SIZES)]
+    process_many(missing, progress)
+
+    hashed = backfill_features(progress)["blobs"]
+    return {"migrated": migrated, "removed": len(removed), "regenerated": len(missing), "hashed": hashed}
+
+def backfill_features(progress=None) -> dict:
+    """
+    Compute the perceptual hash and dominant colour of blobs stored before
+    they existed (or migrated), in the process pool, then pre-fill the colour
+    of items that have none. Returns {blobs, items}.
+    """
+    _, rows = fetchall("SELECT hash, file_path FROM photo_blobs WHERE phash IS NULL OR color IS NULL")
+    results, _ = process_many([(file_path,) for _, file_path in rows], progress, worker=photo_features)
+    with get_conn() as conn:
+        conn.executemany("UPDATE photo_blobs SET phash = ?, color = ? WHERE hash = ?",
+                         [(r["phash"], r["color"], digest) for (digest, _), r in zip(rows, results) if r])
+        items = fill_item_colors(conn)
+    return {"blobs": sum(1 for r in results if r), "items": items}
+
+def fill_item_colors(conn, skus=None) -> int:
+    """Set items.color, where empty, to the colour of the item's first photo."""
+    sql = """
+        UPDATE items SET color = (
+            SELECT b.color FROM photos p JOIN photo_blobs b ON b.hash = p.hash
+            WHERE p.sku = items.sku AND b.color IS NOT NULL
+            ORDER BY p.position LIMIT 1)
+        WHERE (color IS NULL OR TRIM(color) = '')
+          AND EXISTS (SELECT 1 FROM photos p JOIN photo_blobs b ON b.hash = p.hash
+                      WHERE p.sku = items.sku AND b.color IS NOT NULL)
+    """
+    if skus is None:
+        return conn.execute(sql).rowcount
+    return sum(conn.execute(sql + " AND sku = ?", (sku,)).rowcount for sku in skus)
@@ -1,7 +1,10 @@
 \
 import streamlit as st
 import pandas as pd
-from db import upsert, delete, fetchall
+from db import upsert, update_fields, delete, fetchall, fetchall_report, load_stores
+from images import photo_features
+from colors import COLOR_NAMES
+from duplicates import find_similar
 from utils import compute_markdown_price
 
 # Function to generate next SKU
@@ -57,6 +60,30 @@ if 'item_form_data' not in st.session_state:
         'is_editing': False
     }
 
+# Re-consigned pieces: compare a photo of the piece with every archived photo
+with st.expander("🔍 Verificar se a peça já passou pela loja"):
+    intake_photo = st.file_uploader("Foto da peça:", type=["png", "jpg", "jpeg"], key="intake_photo")
+    if intake_photo:
+        features = photo_features(intake_photo.getvalue())
+        # Proposed colour for a new item whose colour is still empty
+        if not st.session_state.item_form_data['color']:
+            st.session_state.item_form_data['color'] = features["color"]
+        st.info(f"🎨 Cor sugerida: {features['color']}")
+        matches = find_similar(features["phash"])
+        if matches:
+            st.warning(f"⚠️ {len(matches)} foto(s) parecida(s) no acervo")
+            stores = load_stores()
+            for distance, store_id, match_sku, _ in matches[:10]:
+                _, match_rows = fetchall_report(
+                    "SELECT category, brand, size, sold_at FROM items WHERE sku = ? AND store_id = ?",
+                    (match_sku, store_id), [store_id])
+                category_, brand_, size_, sold_at_ = match_rows[0] if match_rows else ("", "", "", None)
+                status = f"vendido em {sold_at_}" if sold_at_ else "em estoque"
+                st.write(f"**{match_sku}** ({stores[store_id]['name']}) — {category_ or ''} {brand_ or ''} "
+                         f"{size_ or ''} · {status} · diferença {distance}/64")
+        else:
+            st.success("✅ Nenhuma foto parecida no acervo")
+
 with st.form("add_item", clear_on_submit=False):
     st.subheader("Adicionar / Atualizar Item")
     
@@ -146,7 +173,7 @@ with st.form("add_item", clear_on_submit=False):
     fits = ["Ajustada","Regular","Ampla"]
     fit = st.selectbox("Modelagem", fits,
                       index=fits.index(form_data['fit']) if form_data['fit'] in fits else 1)
-    color = st.text_input("Cor", value=form_data['color'])
+    color = st.text_input("Cor", value=form_data['color'], help="Cores padrão: " + ", ".join(COLOR_NAMES))
     fabric = st.text_input("Tecido", value=form_data['fabric'])
     
     conditions = ["A","A-","B","C"]
@@ -180,6 +207,8 @@ with st.form("add_item", clear_on_submit=False):
         clear_form = st.form_submit_button("Limpar Formulário")
     
     if submitted:
+        # Value the form was loaded with (the photo import may have set it since)
+        loaded_photos_url = form_data['photos_url']
         # Generate final SKU if creating new item
         if not st.session_state.item_form_data['is_editing']:
             final_sku = generate_next_sku()
@@ -219,14 +248,22 @@ with st.form("add_item", clear_on_submit=False):
             st.error("❌ Categoria e Preço de lista são obrigatórios.")
         else:
             try:
-                upsert("items", "sku", dict(
-                    sku=final_sku, consignor_id=consignor_id or None, acquisition_type=acquisition_type,
+                fields = dict(
+                    consignor_id=consignor_id or None, acquisition_type=acquisition_type,
                     category=category, subcategory=subcategory, brand=brand, gender=gender, size=size, fit=fit,
                     color=color, fabric=fabric, condition=condition, flaws=flaws, bust=bust, waist=waist, length=length,
                     cost=cost, list_price=list_price, markdown_stage=int(stage), acquired_at=str(acquired_at), listed_at=str(listed_at),
-                    channel_listed=channel_listed, sold_at=None, sale_price=None, channel_sold=None, days_on_hand=None,
-                    photos_url=photos_url, notes=notes, active=int(active)
-                ))
+                    channel_listed=channel_listed, notes=notes, active=int(active)
+                )
+                if st.session_state.item_form_data['is_editing']:
+                    # Only the form's columns: sale data stays, photos_url only when typed over
+                    if photos_url != loaded_photos_url:
+                        fields['photos_url'] = photos_url
+                    if not update_fields("items", {"sku": final_sku}, fields):
+                        raise ValueError(f"item {final_sku} não encontrado")
+                else:
+                    upsert("items", "sku", dict(sku=final_sku, **fields, sold_at=None, sale_price=None,
+                                                channel_sold=None, days_on_hand=None, photos_url=photos_url))
                 current_price = compute_markdown_price(list_price, int(stage))
                 st.success(f"✅ Item {final_sku} salvo com sucesso! Preço atual: R$ {current_price:.2f}")
                 
@@ -1,7 +1,7 @@
 \
 import streamlit as st
 import pandas as pd
-from db import upsert, delete, fetchall
+from db import upsert, delete, fetchall, update_fields
 
 # Function to generate next sale ID
 def generate_next_sale_id():
@@ -119,8 +119,8 @@ with st.form("add_sale", clear_on_submit=False):
                         payment_method=payment, notes=notes, consignor_id=consignor_id
                     ))
                     # Mark item as sold
-                    fetchall("UPDATE items SET sold_at=?, sale_price=?, channel_sold=? WHERE sku=?", 
-                            (str(date), price, channel, sku))
+                    update_fields("items", {"sku": sku},
+                                  {"sold_at": str(date), "sale_price": price, "channel_sold": channel})
                     
                     net_value = price - discount
                     st.success(f"✅ Venda {final_id} registrada! Valor líquido: R$ {net_value:.2f} | Consignante: {consignor_id or '—'}")
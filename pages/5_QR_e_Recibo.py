@@ -1,25 +1,42 @@
 \
 import streamlit as st
 import io
-import qrcode
+import zipfile
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
+from fonts import pdf_font
+from qr_codes import QR_URL, qr_payload, qr_png, qr_pngs
 
 st.set_page_config(page_title="QR & Recibo", layout="wide")
 st.title("QR de SKU e Recibo simples (PDF)")
 
 st.subheader("Gerar QR para um SKU")
 sku = st.text_input("SKU")
+qr_url = st.text_input("Link no QR (opcional)", value=QR_URL, placeholder="https://loja.com/p/{sku}",
+                       help="Vazio: o QR contém só o SKU. {sku} é trocado pelo SKU")
 if st.button("Gerar QR"):
     if sku:
-        img = qrcode.make(sku)
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        st.image(buf.getvalue(), caption=f"QR do SKU {sku}", width=200)
-        st.download_button("Baixar QR PNG", buf.getvalue(), file_name=f"{sku}_qr.png", mime="image/png")
+        png = qr_png(qr_payload(sku.strip(), qr_url.strip()))
+        st.image(png, caption=f"QR do SKU {sku}", width=200)
+        st.download_button("Baixar QR PNG", png, file_name=f"{sku}_qr.png", mime="image/png")
     else:
         st.error("Informe um SKU.")
 
+skus_text = st.text_area("QR em lote (um SKU por linha)")
+if st.button("Gerar QRs em lote"):
+    skus = list(dict.fromkeys(line.strip() for line in skus_text.splitlines() if line.strip()))
+    if skus:
+        pngs = qr_pngs([qr_payload(s, qr_url.strip()) for s in skus])
+        buf = io.BytesIO()
+        # PNG is already compressed: store the entries as they are
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+            for s, png in zip(skus, pngs):
+                zf.writestr(f"{s}_qr.png", png)
+        st.success(f"✅ {len(skus)} QR codes gerados")
+        st.download_button("Baixar QRs (ZIP)", buf.getvalue(), file_name="qr_codes.zip", mime="application/zip")
+    else:
+        st.error("Informe ao menos um SKU.")
+
 st.divider()
 st.subheader("Gerar Recibo simples (PDF)")
 store = st.text_input("Nome da Loja", value="Brechó")
@@ -32,24 +49,24 @@ if st.button("Gerar PDF"):
     c = canvas.Canvas(packet, pagesize=A4)
     w, h = A4
     y = h - 50
-    c.setFont("Helvetica-Bold", 14)
+    c.setFont(pdf_font("bold"), 14)
     c.drawCentredString(w/2, y, "RECIBO DE CONSIGNAÇÃO — " + store)
     y -= 30
-    c.setFont("Helvetica", 10)
+    c.setFont(pdf_font(), 10)
     c.drawString(40, y, f"Consignante: {cons}     Data: {date}")
     y -= 20
     c.drawString(40, y, "Itens:")
     y -= 15
-    c.setFont("Helvetica", 9)
+    c.setFont(pdf_font(), 9)
     for line in itens.splitlines():
         if not line.strip(): 
             continue
         if y < 80:
-            c.showPage(); y = h - 60; c.setFont("Helvetica", 9)
+            c.showPage(); y = h - 60; c.setFont(pdf_font(), 9)
         c.drawString(50, y, "• " + line.strip())
         y -= 14
     y -= 20
-    c.setFont("Helvetica", 9)
+    c.setFont(pdf_font(), 9)
     c.drawString(40, y, "Assinatura do Consignante: ________________________________")
     y -= 20
     c.drawString(40, y, "Assinatura da Loja: ______________________________________")
@@ -3,11 +3,26 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-from db import fetchall
+from db import fetchall_report, load_stores, current_store
+from aging import roll_forward, bucket_counts
 
 st.set_page_config(page_title="Dashboard", layout="wide")
 st.title("📊 Dashboard - KPIs do Brechó")
 
+# Store selection (several stores = consolidated view)
+stores = load_stores()
+store_ids = st.multiselect("Lojas:", list(stores), default=[current_store()],
+                           format_func=lambda s: stores[s]['name'])
+if not store_ids:
+    st.info("Selecione ao menos uma loja.")
+    st.stop()
+
+for store_id in store_ids:
+    roll_forward(store_id)
+
+def fetch_stores(sql, params=()):
+    return fetchall_report(sql, params, store_ids)
+
 # Date range selector
 col1, col2 = st.columns(2)
 with col1:
@@ -20,11 +35,11 @@ st.divider()
 # Key metrics cards
 def get_kpi_data():
     # Total items in stock
-    _, stock_rows = fetchall("SELECT COUNT(*) FROM items WHERE active=1 AND sold_at IS NULL")
+    _, stock_rows = fetch_stores("SELECT COUNT(*) FROM items WHERE active=1 AND sold_at IS NULL")
     total_stock = stock_rows[0][0] if stock_rows else 0
     
     # Sales in period
-    _, sales_rows = fetchall("""
+    _, sales_rows = fetch_stores("""
         SELECT COUNT(*), SUM(sale_price - COALESCE(discount_value,0)) 
         FROM sales 
         WHERE date >= ? AND date <= ?
@@ -33,7 +48,7 @@ def get_kpi_data():
     period_revenue = sales_rows[0][1] if sales_rows and sales_rows[0][1] else 0
     
     # Sell-through rate (items sold vs listed in period)
-    _, listed_rows = fetchall("""
+    _, listed_rows = fetch_stores("""
         SELECT COUNT(*) FROM items 
         WHERE listed_at >= ? AND listed_at <= ?
     """, (str(start_date), str(end_date)))
@@ -41,10 +56,10 @@ def get_kpi_data():
     sell_through_rate = (period_sales_count / period_listed * 100) if period_listed > 0 else 0
     
     # Average days to sell
-    _, days_rows = fetchall("""
+    _, days_rows = fetch_stores("""
         SELECT AVG(julianday(s.date) - julianday(i.listed_at)) as avg_days
         FROM sales s
-        JOIN items i ON s.sku = i.sku
+        JOIN items i ON s.sku = i.sku AND s.store_id = i.store_id
         WHERE s.date >= ? AND s.date <= ?
     """, (str(start_date), str(end_date)))
     avg_days_to_sell = days_rows[0][0] if days_rows and days_rows[0][0] else 0
@@ -78,10 +93,10 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("📈 Vendas por Categoria")
-    _, cat_sales = fetchall("""
+    _, cat_sales = fetch_stores("""
         SELECT i.category, COUNT(*) as qty, SUM(s.sale_price - COALESCE(s.discount_value,0)) as revenue
         FROM sales s
-        JOIN items i ON s.sku = i.sku
+        JOIN items i ON s.sku = i.sku AND s.store_id = i.store_id
         WHERE s.date >= ? AND s.date <= ?
         GROUP BY i.category
         ORDER BY revenue DESC
@@ -128,13 +143,13 @@ st.divider()
 
 # Size coverage matrix
 st.subheader("📏 Matriz Categoria × Tamanho (Taxa de Venda)")
-_, size_data = fetchall("""
+_, size_data = fetch_stores("""
     SELECT i.category, i.size, 
            COUNT(CASE WHEN s.sku IS NOT NULL THEN 1 END) as sold,
            COUNT(*) as total,
            ROUND(COUNT(CASE WHEN s.sku IS NOT NULL THEN 1 END) * 100.0 / COUNT(*), 1) as rate
     FROM items i
-    LEFT JOIN sales s ON i.sku = s.sku 
+    LEFT JOIN sales s ON i.sku = s.sku AND i.store_id = s.store_id
         AND s.date >= ? AND s.date <= ?
     WHERE i.listed_at >= ?
     GROUP BY i.category, i.size
@@ -167,7 +182,7 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.write("**Estoque por Etapa de Desconto:**")
-    _, markdown_stock = fetchall("""
+    _, markdown_stock = fetch_stores("""
         SELECT markdown_stage,
                CASE markdown_stage 
                    WHEN 0 THEN 'Preço cheio (0%)'
@@ -194,7 +209,7 @@ with col1:
 
 with col2:
     st.write("**Performance por Etapa:**")
-    _, stage_performance = fetchall("""
+    _, stage_performance = fetch_stores("""
         SELECT i.markdown_stage,
                CASE i.markdown_stage 
                    WHEN 0 THEN 'Preço cheio'
@@ -206,7 +221,7 @@ with col2:
                COUNT(*) as sold_qty,
                AVG(julianday(s.date) - julianday(i.listed_at)) as avg_days
         FROM sales s
-        JOIN items i ON s.sku = i.sku
+        JOIN items i ON s.sku = i.sku AND s.store_id = i.store_id
         WHERE s.date >= ? AND s.date <= ?
         GROUP BY i.markdown_stage
         ORDER BY i.markdown_stage
@@ -223,15 +238,15 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("🏆 Top Consignantes (Período)")
-    _, top_consignors = fetchall("""
+    _, top_consignors = fetch_stores("""
         SELECT c.name, 
                COUNT(*) as items_sold,
                SUM(s.sale_price - COALESCE(s.discount_value,0)) as total_revenue,
                AVG(s.sale_price - COALESCE(s.discount_value,0)) as avg_price
         FROM sales s
-        JOIN consignors c ON s.consignor_id = c.id
+        JOIN consignors c ON s.consignor_id = c.id AND s.store_id = c.store_id
         WHERE s.date >= ? AND s.date <= ?
-        GROUP BY c.id, c.name
+        GROUP BY c.store_id, c.id, c.name
         ORDER BY total_revenue DESC
         LIMIT 10
     """, (str(start_date), str(end_date)))
@@ -244,12 +259,12 @@ with col1:
 
 with col2:
     st.subheader("⚡ Itens de Rotação Rápida")
-    _, fast_movers = fetchall("""
+    _, fast_movers = fetch_stores("""
         SELECT i.sku, i.category, i.brand, i.size,
                julianday(s.date) - julianday(i.listed_at) as days_to_sell,
                s.sale_price - COALESCE(s.discount_value,0) as net_price
         FROM sales s
-        JOIN items i ON s.sku = i.sku
+        JOIN items i ON s.sku = i.sku AND s.store_id = i.store_id
         WHERE s.date >= ? AND s.date <= ?
           AND julianday(s.date) - julianday(i.listed_at) <= 7
         ORDER BY days_to_sell ASC
@@ -267,18 +282,12 @@ with col2:
 st.divider()
 st.subheader("🎯 Recomendações de Ação")
 
-# Get slow movers
-_, slow_movers = fetchall("""
-    SELECT category, COUNT(*) as qty
-    FROM items 
-    WHERE active=1 AND sold_at IS NULL 
-      AND julianday('now') - julianday(listed_at) > 60
-      AND markdown_stage < 2
-    GROUP BY category
-    HAVING COUNT(*) > 0
-    ORDER BY qty DESC
-    LIMIT 5
-""")
+# Get slow movers (60+ days, still below 2nd markdown)
+_, slow_rows = bucket_counts(group_by=("category",), min_bucket=2, max_stage=1, store_ids=store_ids)
+slow_by_category = {}
+for category, _bucket, qty in slow_rows:
+    slow_by_category[category] = slow_by_category.get(category, 0) + qty
+slow_movers = sorted(slow_by_category.items(), key=lambda kv: kv[1], reverse=True)[:5]
 
 if slow_movers:
     st.warning("⚠️ **Itens parados há mais de 60 dias (considere aumentar desconto):**")
@@ -286,7 +295,7 @@ if slow_movers:
         st.write(f"• {category}: {qty} itens")
 
 # Stock gaps
-_, stock_gaps = fetchall("""
+_, stock_gaps = fetch_stores("""
     SELECT category, size, COUNT(*) as current_stock
     FROM items 
     WHERE active=1 AND sold_at IS NULL
@@ -1,11 +1,15 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from db import fetchall, get_conn
+from db import fetchall, get_conn, store_db_path, current_store
+from aging import roll_forward, bucket_counts, pending_markdowns, oldest_in_bucket
+from label_history import stale_by_stage
 
 st.set_page_config(page_title="Automação", layout="wide")
 st.title("🤖 Automação - Descontos e Rotinas")
 
+roll_forward()
+
 st.markdown("""
 Esta página automatiza rotinas do brechó:
 - **Atualização automática de descontos** por tempo
@@ -30,56 +34,42 @@ def update_markdown_stages():
     """Update markdown stages based on days since listing"""
     with get_conn() as conn:
         # Items that should move to stage 1 (10% off)
-        conn.execute("""
+        stage1_updates = conn.execute("""
             UPDATE items 
             SET markdown_stage = 1 
             WHERE active = 1 
               AND sold_at IS NULL 
               AND markdown_stage = 0 
               AND julianday('now') - julianday(listed_at) > 30
-        """)
-        stage1_updates = conn.total_changes
+        """).rowcount
         
         # Items that should move to stage 2 (25% off)
-        conn.execute("""
+        stage2_updates = conn.execute("""
             UPDATE items 
             SET markdown_stage = 2 
             WHERE active = 1 
               AND sold_at IS NULL 
               AND markdown_stage = 1 
               AND julianday('now') - julianday(listed_at) > 60
-        """)
-        stage2_updates = conn.total_changes - stage1_updates
+        """).rowcount
         
         # Items that should move to stage 3 (40% off)
-        conn.execute("""
+        stage3_updates = conn.execute("""
             UPDATE items 
             SET markdown_stage = 3 
             WHERE active = 1 
               AND sold_at IS NULL 
               AND markdown_stage = 2 
               AND julianday('now') - julianday(listed_at) > 90
-        """)
-        stage3_updates = conn.total_changes - stage1_updates - stage2_updates
+        """).rowcount
         
         return stage1_updates, stage2_updates, stage3_updates
 
 # Check items pending markdown updates
-_, pending_updates = fetchall("""
-    SELECT 
-        CASE 
-            WHEN julianday('now') - julianday(listed_at) > 90 AND markdown_stage < 3 THEN 'Para 40% OFF'
-            WHEN julianday('now') - julianday(listed_at) > 60 AND markdown_stage < 2 THEN 'Para 25% OFF'
-            WHEN julianday('now') - julianday(listed_at) > 30 AND markdown_stage < 1 THEN 'Para 10% OFF'
-            ELSE 'OK'
-        END as update_needed,
-        COUNT(*) as qty
-    FROM items 
-    WHERE active = 1 AND sold_at IS NULL
-    GROUP BY update_needed
-    HAVING update_needed != 'OK'
-    ORDER BY qty DESC
-""")
+_, pending_rows = pending_markdowns()
+bucket_targets = {1: 'Para 10% OFF', 2: 'Para 25% OFF', 3: 'Para 40% OFF'}
+pending_updates = sorted(((bucket_targets[bucket], qty) for bucket, qty in pending_rows),
+                         key=lambda r: r[1], reverse=True)
 
 if pending_updates:
     st.warning(f"⚠️ **{sum(qty for _, qty in pending_updates)} itens** precisam de atualização de desconto:")
@@ -97,6 +87,10 @@ if pending_updates:
                 st.write(f"• {stage2} itens → 25% OFF")
             if stage3 > 0:
                 st.write(f"• {stage3} itens → 40% OFF")
+            _, stale = stale_by_stage()
+            if stale:
+                st.info(f"🏷️ {sum(qty for _, qty in stale)} etiquetas impressas estão com preço antigo: "
+                        "reimprima em Etiquetas → \"Etiquetas desatualizadas\"")
         else:
             st.info("Nenhum item foi atualizado.")
 else:
@@ -111,16 +105,7 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.write("**Itens há mais de 90 dias (candidatos a bundle/doação):**")
-    _, very_slow = fetchall("""
-        SELECT sku, category, brand, size, 
-               julianday('now') - julianday(listed_at) as days_listed,
-               list_price, markdown_stage
-        FROM items 
-        WHERE active = 1 AND sold_at IS NULL 
-          AND julianday('now') - julianday(listed_at) > 90
-        ORDER BY days_listed DESC
-        LIMIT 20
-    """)
+    _, very_slow = oldest_in_bucket(3, limit=20)
     
     if very_slow:
         df_slow = pd.DataFrame(very_slow, columns=[
@@ -139,17 +124,16 @@ with col1:
 
 with col2:
     st.write("**Categorias com maior acúmulo de estoque:**")
-    _, category_stock = fetchall("""
-        SELECT category, 
-               COUNT(*) as total_items,
-               COUNT(CASE WHEN julianday('now') - julianday(listed_at) > 60 THEN 1 END) as old_items,
-               ROUND(COUNT(CASE WHEN julianday('now') - julianday(listed_at) > 60 THEN 1 END) * 100.0 / COUNT(*), 1) as old_pct
-        FROM items 
-        WHERE active = 1 AND sold_at IS NULL
-        GROUP BY category
-        HAVING total_items > 5
-        ORDER BY old_pct DESC, total_items DESC
-    """)
+    _, category_buckets = bucket_counts(group_by=("category",))
+    category_stock = []
+    if category_buckets:
+        df_buckets = pd.DataFrame(category_buckets, columns=['category', 'bucket', 'qty'])
+        df_buckets['old'] = df_buckets['qty'].where(df_buckets['bucket'] >= 2, 0)
+        df_cat = df_buckets.groupby('category')[['qty', 'old']].sum()
+        df_cat = df_cat[df_cat['qty'] > 5]
+        df_cat['pct'] = (df_cat['old'] * 100.0 / df_cat['qty']).round(1)
+        df_cat = df_cat.sort_values(['pct', 'qty'], ascending=False)
+        category_stock = list(df_cat.reset_index().itertuples(index=False, name=None))
     
     if category_stock:
         df_cat_stock = pd.DataFrame(category_stock, columns=[
@@ -277,35 +261,22 @@ st.subheader("📋 Resumo de Ações Sugeridas")
 actions = []
 
 # Check for markdown updates needed
-_, markdown_check = fetchall("""
-    SELECT COUNT(*) FROM items 
-    WHERE active = 1 AND sold_at IS NULL 
-      AND ((julianday('now') - julianday(listed_at) > 30 AND markdown_stage = 0)
-           OR (julianday('now') - julianday(listed_at) > 60 AND markdown_stage = 1)
-           OR (julianday('now') - julianday(listed_at) > 90 AND markdown_stage = 2))
-""")
-markdown_pending = markdown_check[0][0] if markdown_check else 0
+markdown_pending = sum(qty for _, qty in pending_updates)
 if markdown_pending > 0:
     actions.append(f"🏷️ Atualizar desconto de {markdown_pending} itens")
 
 # Check for very old items
-_, old_items_check = fetchall("""
-    SELECT COUNT(*) FROM items 
-    WHERE active = 1 AND sold_at IS NULL 
-      AND julianday('now') - julianday(listed_at) > 90
-""")
-old_items = old_items_check[0][0] if old_items_check else 0
+_, old_items_check = bucket_counts(group_by=(), min_bucket=3)
+old_items = sum(qty for _, qty in old_items_check)
 if old_items > 10:
     actions.append(f"📦 Considerar bundle/doação de {old_items} itens antigos (>90 dias)")
 
 # Check for overstocked categories
 _, overstock_check = fetchall("""
-    SELECT COUNT(DISTINCT category) FROM (
-        SELECT category, COUNT(*) as qty
-        FROM items 
-        WHERE active = 1 AND sold_at IS NULL
+    SELECT COUNT(*) FROM (
+        SELECT category FROM aging_summary
         GROUP BY category
-        HAVING qty > 20
+        HAVING SUM(qty) > 20
     )
 """)
 overstock_cats = overstock_check[0][0] if overstock_check else 0
@@ -337,9 +308,9 @@ if st.button("💾 Fazer Backup Manual do Banco"):
     import shutil
     from datetime import datetime
     
-    backup_name = f"brecho_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+    backup_name = f"brecho_backup_{current_store()}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
     try:
-        shutil.copy2("brecho.db", backup_name)
+        shutil.copy2(store_db_path(), backup_name)
         st.success(f"✅ Backup criado: {backup_name}")
         
         # Offer download
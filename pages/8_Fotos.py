@@ -1,18 +1,49 @@
 import streamlit as st
 import os
+import time
 from pathlib import Path
 import pandas as pd
-from PIL import Image
 import io
-from db import fetchall, upsert
+import tempfile
+from db import fetchall, GALLERY_KEY_SQL
+from images import PHOTOS_DIR, variant_path, reprocess_all, make_preview, compression_report
+from manifest import save_uploads, sku_photos, reconcile, backfill_features
+from cleanup import (pending_cleanup, run_cleanup, restore_sku,
+                     SOLD_RETENTION_DAYS, QUARANTINE_DAYS)
+from photo_server import start_server, img_tag
+from importer import import_photos, MAX_PHOTOS_PER_ITEM, cv2
+from duplicates import find_similar, duplicate_pairs
 
 st.set_page_config(page_title="Fotos", layout="wide")
 st.title("📸 Gestão de Fotos dos Itens")
 
 # Create photos directory if it doesn't exist
-PHOTOS_DIR = Path("photos")
 PHOTOS_DIR.mkdir(exist_ok=True)
 
+# Gallery images come from the photo server (hash URLs, browser-cached) when it is up
+photo_server_up = start_server()
+qr_available = cv2 is not None
+
+def show_photo(photo_path, caption=None):
+    try:
+        if not photo_server_up:
+            raise ValueError
+        st.markdown(img_tag(photo_path, "card", alt=caption or ""), unsafe_allow_html=True)
+        if caption:
+            st.caption(caption)
+    except ValueError:
+        # Server down or a legacy file outside photos/blobs (not migrated yet)
+        st.image(str(variant_path(photo_path, "card")), caption=caption, use_container_width=True)
+
+def show_compression(report):
+    """Table of bytes per output profile and compression ratio vs the originals."""
+    if not report:
+        return
+    st.dataframe(pd.DataFrame([
+        {"Perfil": size, "Tamanho (KB)": round(nbytes / 1024, 1), "Compressão": f"{ratio:.1f}x"}
+        for size, nbytes, ratio in report
+    ]), hide_index=True)
+
 st.markdown("""
 Faça upload e gerencie fotos dos itens para usar no Instagram e vendas online.
 **Formato recomendado:** 3 fotos por item (frontal, lateral, detalhe/defeito)
@@ -55,40 +86,35 @@ with col1:
                 st.success(f"✅ {len(uploaded_files)} foto(s) selecionada(s)")
                 
                 if st.button("💾 Salvar Fotos", type="primary"):
-                    # Create folder for this SKU
-                    sku_folder = PHOTOS_DIR / selected_sku
-                    sku_folder.mkdir(exist_ok=True)
-                    
-                    saved_files = []
-                    for i, uploaded_file in enumerate(uploaded_files):
-                        # Save file
-                        file_extension = uploaded_file.name.split('.')[-1].lower()
-                        filename = f"{selected_sku}_{i+1}.{file_extension}"
-                        file_path = sku_folder / filename
-                        
-                        # Resize and save image
-                        img = Image.open(uploaded_file)
-                        # Resize for social media (max 1080px)
-                        img.thumbnail((1080, 1080), Image.Resampling.LANCZOS)
-                        img.save(file_path, optimize=True, quality=85)
-                        saved_files.append(str(file_path))
+                    # New content is encoded for every channel profile (social, instagram,
+                    # web, card, thumb) in worker processes and stored by hash; known
+                    # photos are only linked
+                    progress_bar = st.progress(0.0, text="Processando fotos...")
+                    result = save_uploads(
+                        selected_sku,
+                        [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files],
+                        progress=lambda done, total: progress_bar.progress(
+                            done / total, text=f"Processando fotos... {done}/{total}"))
+                    for path, message in result["errors"]:
+                        st.error(f"❌ Erro ao processar {Path(path).name}: {message}")
+                    saved_photos = sku_photos(selected_sku)
                     
-                    # Update item with photos path
-                    photos_url = str(sku_folder)
-                    _, current_item = fetchall("SELECT * FROM items WHERE sku = ?", (selected_sku,))
-                    if current_item:
-                        item_data = dict(zip([
-                            'sku', 'consignor_id', 'acquisition_type', 'category', 'subcategory',
-                            'brand', 'gender', 'size', 'fit', 'color', 'fabric', 'condition',
-                            'flaws', 'bust', 'waist', 'length', 'cost', 'list_price',
-                            'markdown_stage', 'acquired_at', 'listed_at', 'channel_listed',
-                            'sold_at', 'sale_price', 'channel_sold', 'days_on_hand',
-                            'photos_url', 'notes', 'active'
-                        ], current_item[0]))
-                        item_data['photos_url'] = photos_url
-                        upsert("items", "sku", item_data)
-                    
-                    st.success(f"✅ {len(saved_files)} fotos salvas para {selected_sku}")
+                    if result["unchanged"]:
+                        st.info(f"Fotos de {selected_sku} já estavam salvas, nada a fazer")
+                    else:
+                        st.success(f"✅ {len(saved_photos)} fotos salvas para {selected_sku} "
+                                   f"({result['processed']} novas, {result['reused']} já existentes)")
+                        show_compression(result["compression"])
+                    # Same piece photographed under another SKU (re-consigned or re-listed)?
+                    _, phash_rows = fetchall("""
+                        SELECT DISTINCT b.phash FROM photos p JOIN photo_blobs b ON b.hash = p.hash
+                        WHERE p.sku = ? AND b.phash IS NOT NULL
+                    """, (selected_sku,))
+                    similar = {(store_id, sku) for phash, in phash_rows
+                               for _, store_id, sku, _ in find_similar(phash, exclude_sku=selected_sku)}
+                    if similar:
+                        st.warning("⚠️ Fotos parecidas com as de outros itens: "
+                                   + ", ".join(f"{sku} ({store_id})" for store_id, sku in sorted(similar)))
             
             elif uploaded_files and len(uploaded_files) > 5:
                 st.error("❌ Máximo 5 fotos por item")
@@ -102,8 +128,51 @@ with col2:
         cols = st.columns(min(len(uploaded_files), 3))
         for i, uploaded_file in enumerate(uploaded_files):
             with cols[i % 3]:
-                img = Image.open(uploaded_file)
-                st.image(img, caption=f"Foto {i+1}", use_container_width=True)
+                try:
+                    st.image(make_preview(uploaded_file), caption=f"Foto {i+1}", use_container_width=True)
+                except Exception as e:
+                    st.error(f"Erro ao abrir foto {i+1}: {e}")
+
+st.divider()
+
+# Bulk import of a whole photo shoot
+st.subheader("📦 Importação em Lote")
+st.caption("Arquivos nomeados com o SKU (ex.: BH-2508-0001_1.jpg) ou com a etiqueta QR "
+           "visível na primeira foto de cada peça" + ("" if qr_available else " (leitura de QR requer opencv-python)"))
+
+col1, col2 = st.columns(2)
+with col1:
+    import_zip = st.file_uploader("Arquivo ZIP da sessão de fotos:", type=["zip"], key="import_zip")
+with col2:
+    import_folder = st.text_input("...ou pasta no computador da loja:", placeholder="/caminho/da/sessao")
+    import_use_qr = st.checkbox("Ler QR das etiquetas", value=qr_available, disabled=not qr_available)
+
+if st.button("📥 Importar fotos", disabled=not (import_zip or import_folder)):
+    progress_bar = st.progress(0.0, text="Processando fotos...")
+    progress = lambda done, total: progress_bar.progress(done / total, text=f"Processando fotos... {done}/{total}")
+    start_time = time.perf_counter()
+    if import_zip:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_path = Path(tmp_dir) / "fotos.zip"
+            zip_path.write_bytes(import_zip.getvalue())
+            result = import_photos(zip_path, import_use_qr, progress)
+    elif os.path.isdir(import_folder):
+        result = import_photos(import_folder, import_use_qr, progress)
+    else:
+        result = None
+        st.error(f"❌ Pasta não encontrada: {import_folder}")
+    if result:
+        elapsed = time.perf_counter() - start_time
+        st.success(f"✅ {result['photos']} fotos importadas para {result['skus']} itens em {elapsed:.1f}s "
+                   f"({result['processed']} novas, {result['reused']} já existentes)")
+        if result["unmatched"]:
+            st.warning(f"{len(result['unmatched'])} arquivos sem SKU: " + ", ".join(result["unmatched"][:20]))
+        if result["unknown_skus"]:
+            st.warning("SKUs não cadastrados ou inativos: " + ", ".join(result["unknown_skus"][:20]))
+        if result["skipped"]:
+            st.warning(f"{len(result['skipped'])} fotos ignoradas (máx. {MAX_PHOTOS_PER_ITEM} por item)")
+        for path, message in result["errors"][:10]:
+            st.error(f"❌ {path}: {message}")
 
 st.divider()
 
@@ -111,20 +180,29 @@ st.divider()
 st.subheader("🖼️ Galeria de Fotos dos Itens")
 
 # Filter options
-col1, col2, col3 = st.columns(3)
+col1, col2, col3, col4, col5 = st.columns(5)
 with col1:
     filter_category = st.selectbox("Filtrar por categoria:", 
                                   ["Todas"] + ["Vestido", "Camisa", "Camiseta", "Calça", 
                                               "Jeans", "Saia", "Blazer", "Casaco", "Short", 
                                               "Macacão", "Sapato", "Bolsa", "Acessório"])
 with col2:
-    filter_brand = st.text_input("Filtrar por marca:")
+    filter_brand = st.text_input("Filtrar por marca:", help="Início do nome da marca")
 with col3:
+    age_options = {"Qualquer": 0, "Mais de 30 dias": 30, "Mais de 60 dias": 60, "Mais de 90 dias": 90}
+    filter_age = age_options[st.selectbox("Tempo em estoque:", list(age_options))]
+with col4:
+    page_size = st.selectbox("Itens por página:", [12, 24, 48])
+with col5:
     show_only_with_photos = st.checkbox("Apenas itens com fotos", value=False)
 
-# Get items with photos
-query = """
-    SELECT sku, category, brand, size, condition, list_price, markdown_stage, photos_url
+# Keyset pagination on (listed_at, sku): each page starts after the last item of the
+# previous one, walking idx_items_gallery*, so a page costs the same at any inventory size
+query = f"""
+    SELECT sku, category, brand, size, condition, list_price, markdown_stage,
+           (SELECT file_path FROM photos p WHERE p.sku = items.sku ORDER BY position LIMIT 1) AS first_photo,
+           (SELECT COUNT(*) FROM photos p WHERE p.sku = items.sku) AS photo_count,
+           {GALLERY_KEY_SQL} AS sort_key
     FROM items 
     WHERE active = 1 AND sold_at IS NULL
 """
@@ -135,25 +213,59 @@ if filter_category != "Todas":
     params.append(filter_category)
 
 if filter_brand:
-    query += " AND brand LIKE ?"
-    params.append(f"%{filter_brand}%")
+    # Prefix match, served by the NOCASE brand index; % and _ in the brand match literally
+    query += " AND brand LIKE ? ESCAPE '\\'"
+    params.append(filter_brand.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+
+if filter_age:
+    # Same boundary as db.AGING_BUCKET_SQL: more than N full days
+    query += f" AND listed_at IS NOT NULL AND {GALLERY_KEY_SQL} < datetime('now', ?)"
+    params.append(f"-{filter_age} days")
 
 if show_only_with_photos:
-    query += " AND photos_url IS NOT NULL AND photos_url != ''"
+    query += " AND EXISTS (SELECT 1 FROM photos p WHERE p.sku = items.sku)"
+
+# Page cursors are kept per filter set; changing a filter starts over at page 1
+filters = (filter_category, filter_brand, filter_age, page_size, show_only_with_photos)
+if st.session_state.get("gallery_filters") != filters:
+    st.session_state["gallery_filters"] = filters
+    st.session_state["gallery_cursors"] = [None]
+cursors = st.session_state["gallery_cursors"]
 
-query += " ORDER BY listed_at DESC"
+cursor = cursors[-1]
+if cursor:
+    query += f" AND {GALLERY_KEY_SQL} <= ? AND ({GALLERY_KEY_SQL}, sku) < (?, ?)"
+    params += [cursor[0], cursor[0], cursor[1]]
+
+query += f" ORDER BY {GALLERY_KEY_SQL} DESC, sku DESC LIMIT ?"
+params.append(page_size + 1)
 
 _, gallery_items = fetchall(query, params)
+has_next = len(gallery_items) > page_size
+gallery_items = gallery_items[:page_size]
+
+nav1, nav2, nav3 = st.columns([1, 2, 1])
+with nav1:
+    if st.button("⬅️ Anterior", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+with nav2:
+    st.caption(f"Página {len(cursors)}")
+with nav3:
+    if st.button("Próxima ➡️", disabled=not has_next):
+        last = gallery_items[-1]
+        cursors.append((last[-1], last[0]))
+        st.rerun()
 
 if gallery_items:
-    # Display items in grid
+    # Display items in grid (only this page's images are loaded)
     items_per_row = 3
     for i in range(0, len(gallery_items), items_per_row):
         cols = st.columns(items_per_row)
         for j in range(items_per_row):
             if i + j < len(gallery_items):
                 item = gallery_items[i + j]
-                sku, category, brand, size, condition, list_price, markdown_stage, photos_url = item
+                sku, category, brand, size, condition, list_price, markdown_stage, first_photo, photo_count, _ = item
                 
                 with cols[j]:
                     st.write(f"**{sku}**")
@@ -171,35 +283,26 @@ if gallery_items:
                         st.write(f"**R$ {current_price:.2f}**")
                     
                     # Show photos if available
-                    if photos_url and Path(photos_url).exists():
-                        photo_files = list(Path(photos_url).glob("*.jpg")) + \
-                                     list(Path(photos_url).glob("*.jpeg")) + \
-                                     list(Path(photos_url).glob("*.png"))
-                        
-                        if photo_files:
-                            # Show first photo as thumbnail
-                            try:
-                                img = Image.open(photo_files[0])
-                                st.image(img, use_container_width=True)
-                                
-                                # Button to view all photos
-                                if st.button(f"Ver todas ({len(photo_files)})", key=f"view_{sku}"):
-                                    st.session_state[f"show_photos_{sku}"] = True
-                                
-                                # Show all photos in expander if requested
-                                if st.session_state.get(f"show_photos_{sku}", False):
-                                    with st.expander(f"Todas as fotos de {sku}", expanded=True):
-                                        for photo_file in photo_files:
-                                            img = Image.open(photo_file)
-                                            st.image(img, caption=photo_file.name, use_container_width=True)
-                                        if st.button("Fechar", key=f"close_{sku}"):
-                                            st.session_state[f"show_photos_{sku}"] = False
-                                            st.rerun()
-                                            
-                            except Exception as e:
-                                st.error(f"Erro ao carregar foto: {e}")
-                        else:
-                            st.info("📁 Pasta criada, sem fotos")
+                    if photo_count:
+                        # Show first photo as thumbnail
+                        try:
+                            show_photo(first_photo)
+                            
+                            # Button to view all photos
+                            if st.button(f"Ver todas ({photo_count})", key=f"view_{sku}"):
+                                st.session_state[f"show_photos_{sku}"] = True
+                            
+                            # Show all photos in expander if requested
+                            if st.session_state.get(f"show_photos_{sku}", False):
+                                with st.expander(f"Todas as fotos de {sku}", expanded=True):
+                                    for n, photo_file in enumerate(sku_photos(sku), 1):
+                                        show_photo(photo_file, caption=f"Foto {n}")
+                                    if st.button("Fechar", key=f"close_{sku}"):
+                                        st.session_state[f"show_photos_{sku}"] = False
+                                        st.rerun()
+                                        
+                        except Exception as e:
+                            st.error(f"Erro ao carregar foto: {e}")
                     else:
                         st.warning("📷 Sem fotos")
                         if st.button(f"Adicionar fotos", key=f"add_{sku}"):
@@ -221,10 +324,11 @@ col1, col2, col3 = st.columns(3)
 _, photo_stats = fetchall("""
     SELECT 
         COUNT(*) as total_items,
-        COUNT(CASE WHEN photos_url IS NOT NULL AND photos_url != '' THEN 1 END) as with_photos,
-        COUNT(CASE WHEN photos_url IS NULL OR photos_url = '' THEN 1 END) as without_photos
-    FROM items 
-    WHERE active = 1 AND sold_at IS NULL
+        COUNT(CASE WHEN has_photos THEN 1 END) as with_photos,
+        COUNT(CASE WHEN NOT has_photos THEN 1 END) as without_photos
+    FROM (SELECT EXISTS (SELECT 1 FROM photos p WHERE p.sku = items.sku) AS has_photos
+          FROM items 
+          WHERE active = 1 AND sold_at IS NULL)
 """)
 
 if photo_stats:
@@ -246,10 +350,11 @@ st.write("**Cobertura de fotos por categoria:**")
 _, category_photos = fetchall("""
     SELECT category,
            COUNT(*) as total,
-           COUNT(CASE WHEN photos_url IS NOT NULL AND photos_url != '' THEN 1 END) as with_photos,
-           ROUND(COUNT(CASE WHEN photos_url IS NOT NULL AND photos_url != '' THEN 1 END) * 100.0 / COUNT(*), 1) as coverage_pct
-    FROM items 
-    WHERE active = 1 AND sold_at IS NULL
+           SUM(has_photos) as with_photos,
+           ROUND(SUM(has_photos) * 100.0 / COUNT(*), 1) as coverage_pct
+    FROM (SELECT category, EXISTS (SELECT 1 FROM photos p WHERE p.sku = items.sku) AS has_photos
+          FROM items 
+          WHERE active = 1 AND sold_at IS NULL)
     GROUP BY category
     ORDER BY coverage_pct ASC, total DESC
 """)
@@ -289,7 +394,7 @@ with col1:
                 SELECT sku, category, brand, size, list_price
                 FROM items 
                 WHERE active = 1 AND sold_at IS NULL 
-                  AND (photos_url IS NULL OR photos_url = '')
+                  AND NOT EXISTS (SELECT 1 FROM photos p WHERE p.sku = items.sku)
                 ORDER BY list_price DESC
             """
         elif priority_filter == "Itens novos (< 30 dias) sem foto":
@@ -297,7 +402,7 @@ with col1:
                 SELECT sku, category, brand, size, list_price
                 FROM items 
                 WHERE active = 1 AND sold_at IS NULL 
-                  AND (photos_url IS NULL OR photos_url = '')
+                  AND NOT EXISTS (SELECT 1 FROM photos p WHERE p.sku = items.sku)
                   AND julianday('now') - julianday(listed_at) <= 30
                 ORDER BY listed_at DESC
             """
@@ -306,7 +411,7 @@ with col1:
                 SELECT sku, category, brand, size, list_price
                 FROM items 
                 WHERE active = 1 AND sold_at IS NULL 
-                  AND (photos_url IS NULL OR photos_url = '')
+                  AND NOT EXISTS (SELECT 1 FROM photos p WHERE p.sku = items.sku)
                   AND list_price >= 50
                 ORDER BY list_price DESC
             """
@@ -315,7 +420,7 @@ with col1:
                 SELECT sku, category, brand, size, list_price
                 FROM items 
                 WHERE active = 1 AND sold_at IS NULL 
-                  AND (photos_url IS NULL OR photos_url = '')
+                  AND NOT EXISTS (SELECT 1 FROM photos p WHERE p.sku = items.sku)
                   AND category IN ('Vestido', 'Blazer', 'Casaco', 'Bolsa')
                 ORDER BY category, list_price DESC
             """
@@ -338,29 +443,79 @@ with col1:
         else:
             st.success("✅ Todos os itens já têm fotos!")
 
+    st.write("**Reprocessar fotos:**")
+    st.caption("Regera miniaturas e cards de todas as fotos em paralelo")
+    if st.button("🔄 Reprocessar todas as fotos"):
+        progress_bar = st.progress(0.0, text="Reprocessando...")
+        start_time = time.perf_counter()
+        results, errors = reprocess_all(progress=lambda done, total: progress_bar.progress(
+            done / total, text=f"Reprocessando... {done}/{total}"))
+        elapsed = time.perf_counter() - start_time
+        if results:
+            st.success(f"✅ {len(results) - len(errors)} fotos reprocessadas em {elapsed:.1f}s "
+                       f"({len(results) / elapsed:.1f} fotos/s)")
+            show_compression(compression_report(results))
+        else:
+            st.info("Nenhuma foto encontrada")
+        for path, message in errors[:10]:
+            st.error(f"❌ {path}: {message}")
+
 with col2:
-    st.write("**Limpeza de arquivos órfãos:**")
-    if st.button("🧹 Verificar Arquivos Não Utilizados"):
-        # Find photo folders that don't correspond to active items
-        _, active_skus = fetchall("SELECT sku FROM items WHERE active = 1")
-        active_sku_set = {sku[0] for sku in active_skus}
-        
-        orphaned_folders = []
-        if PHOTOS_DIR.exists():
-            for folder in PHOTOS_DIR.iterdir():
-                if folder.is_dir() and folder.name not in active_sku_set:
-                    orphaned_folders.append(folder.name)
-        
-        if orphaned_folders:
-            st.warning(f"⚠️ {len(orphaned_folders)} pastas órfãs encontradas:")
-            for folder in orphaned_folders[:10]:  # Show first 10
-                st.write(f"• {folder}")
-            if len(orphaned_folders) > 10:
-                st.write(f"... e mais {len(orphaned_folders) - 10}")
-            
-            st.info("💡 Considere remover manualmente pastas de itens inativos ou vendidos")
+    st.write("**Limpeza de fotos sem uso:**")
+    st.caption("Tira as fotos de itens excluídos, inativos ou vendidos há mais de N dias; "
+               f"os arquivos ficam {QUARANTINE_DAYS} dias em quarentena antes de serem apagados")
+    sold_days = st.number_input("Dias após a venda ou inativação:", min_value=0, value=SOLD_RETENTION_DAYS, step=30)
+    pending = pending_cleanup(sold_days)
+    reason_labels = {"orphaned": "sem cadastro", "sold": "vendidos", "inactive": "inativos"}
+    if pending:
+        st.write(", ".join(f"{count} itens {reason_labels[reason]}" for reason, count in pending.items()))
+    if st.button("🧹 Limpar fotos sem uso"):
+        progress_bar = st.progress(0.0, text="Verificando arquivos...")
+        stats = run_cleanup(sold_days, progress=lambda done, total: progress_bar.progress(
+            done / total, text=f"Verificando arquivos... {done}/{total} pastas"))
+        st.success(f"✅ Fotos retiradas de {stats['skus']} itens; {stats['blobs']} arquivos em quarentena "
+                   f"({stats['bytes'] / 1024 / 1024:.1f} MB); "
+                   f"{stats['purged_bytes'] / 1024 / 1024:.1f} MB liberados da quarentena")
+    restore_sku_input = st.text_input("Restaurar fotos do SKU:")
+    if st.button("↩️ Restaurar") and restore_sku_input:
+        restored = restore_sku(restore_sku_input.strip())
+        if restored:
+            st.success(f"✅ {restored} fotos restauradas para {restore_sku_input}")
+        else:
+            st.warning("Nenhuma foto em quarentena para este SKU")
+    
+    st.write("**Sincronizar cadastro de fotos:**")
+    st.caption("Atualiza o cadastro de fotos a partir dos arquivos na pasta photos/")
+    if st.button("🔁 Sincronizar com arquivos"):
+        progress_bar = st.progress(0.0, text="Gerando miniaturas...")
+        result = reconcile(progress=lambda done, total: progress_bar.progress(
+            done / total, text=f"Gerando miniaturas... {done}/{total}"))
+        st.success(f"✅ {result['migrated']} fotos migradas, {result['removed']} removidas, "
+                   f"{result['regenerated']} com miniaturas regeradas, {result['hashed']} com hash e cor calculados")
+    
+    st.write("**Cores dos itens:**")
+    st.caption("Calcula a cor predominante das fotos e preenche a cor dos itens que estão sem")
+    if st.button("🎨 Preencher cores pelas fotos"):
+        progress_bar = st.progress(0.0, text="Analisando fotos...")
+        start_time = time.perf_counter()
+        result = backfill_features(progress=lambda done, total: progress_bar.progress(
+            done / total, text=f"Analisando fotos... {done}/{total}"))
+        elapsed = time.perf_counter() - start_time
+        st.success(f"✅ {result['blobs']} fotos analisadas em {elapsed:.1f}s, "
+                   f"{result['items']} itens com cor preenchida")
+    
+    st.write("**Fotos duplicadas:**")
+    st.caption("Itens diferentes com fotos quase idênticas (peça reconsignada ou cadastrada duas vezes)")
+    if st.button("🔍 Procurar duplicatas"):
+        pairs = duplicate_pairs()
+        if pairs:
+            st.warning(f"⚠️ {len(pairs)} pares de itens com fotos parecidas")
+            st.dataframe(pd.DataFrame([
+                {"Item": f"{a[1]} ({a[0]})", "Parecido com": f"{b[1]} ({b[0]})", "Diferença": f"{d}/64"}
+                for d, a, b in pairs
+            ]), hide_index=True)
         else:
-            st.success("✅ Nenhuma pasta órfã encontrada")
+            st.success("✅ Nenhuma duplicata encontrada")
 
 # Tips section
 st.divider()
@@ -1,9 +1,17 @@
-import streamlit as st
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
 import io
-from db import fetchall
-from utils import compute_markdown_price
+import os
+import time
+from itertools import chain, islice
+import streamlit as st
+import pandas as pd
+from PIL import Image
+from db import fetchall, iter_rows
+from labels import (LABEL_FORMATS, TEMPLATES, CUSTOM_FORMAT, custom_template, render_plan,
+                    render_label, render_preview, labels_per_page, label_png,
+                    write_labels_pdf, write_labels_png_zip, BatchKey, batch_key, cached_label_file)
+from printers import LANGUAGES, PRINTER_DPI, write_printer_job, send_file
+from qr_codes import QR_URL
+from label_history import LABEL_COLUMNS, printed_values, record_prints, stale_query, stale_by_stage, print_history
 
 st.set_page_config(page_title="Etiquetas", layout="wide")
 st.title("🏷️ Gerador de Etiquetas")
@@ -13,6 +21,183 @@ Gere etiquetas profissionais para impressão térmica ou comum.
 **Tamanhos suportados:** 58x40mm (térmica), 70x50mm, A4 (múltiplas etiquetas)
 """)
 
+PDF_OUTPUT = "PDF"
+PNG_OUTPUT = "PNG 1-bit (ZIP no lote)"
+# Display widths of the previews (single label or sheet, batch)
+PREVIEW_WIDTH = 300
+BATCH_PREVIEW_WIDTH = 200
+STAGE_NAMES = {0: "Preço cheio", 1: "1º desconto (-10%)", 2: "2º desconto (-25%)", 3: "3º desconto (-40%)"}
+
+def preview_png(img, width: int) -> bytes:
+    """
+    Preview as PNG at its display width, encoded once: st.image passes bytes
+    that need no resizing through untouched, so reruns encode nothing.
+    """
+    img = img.convert("L") if img.mode == "1" else img
+    if img.width > width:
+        img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def generate_labels(rows, total, name, plan, output, key, dpi=None, printer_target="", written_key=None,
+                    printed=None):
+    """
+    Write the labels of rows (any iterable, read once) as a PDF, PNG/ZIP or
+    printer command stream to the label cache, optionally send it to the
+    printer, and keep PNG previews of the first labels in session state.
+    key (labels.batch_key of the same rows, plan, output and DPI) names the
+    file: a batch generated before is served from the cache, not rendered again.
+    written_key: see labels.cached_label_file. printed() gives the job's
+    label_history.printed_values rows: recorded once the printer took the file,
+    otherwise kept until the labels are marked as printed.
+    Returns False (with the error shown) when the labels cannot be generated.
+    """
+    rows = iter(rows)
+    head = list(islice(rows, max(labels_per_page(plan), 3)))
+    if output == PDF_OUTPUT:
+        extension, mime = "pdf", "application/pdf"
+    elif output == PNG_OUTPUT:
+        extension, mime = ("png", "image/png") if total == 1 else ("zip", "application/zip")
+    else:
+        extension, mime = LANGUAGES[output][1], "application/octet-stream"
+    bar = st.progress(0.0, text=f"Gerando etiquetas... 0/{total}")
+    progress = lambda done, total: bar.progress(done / total, text=f"Gerando etiquetas... {done}/{total}")
+
+    def write(out):
+        if output == PDF_OUTPUT:
+            write_labels_pdf(chain(head, rows), plan, out, total, progress)
+        elif output == PNG_OUTPUT and total == 1:
+            out.write(label_png(plan, head[0]))
+        elif output == PNG_OUTPUT:
+            write_labels_png_zip(chain(head, rows), plan, out, total, progress)
+        else:
+            write_printer_job(chain(head, rows), plan, output, out, dpi, total, progress)
+
+    started = time.perf_counter()
+    try:
+        path, cached = cached_label_file(key, extension, write, written_key)
+    except ValueError as e:
+        # e.g. the QR does not fit the label at the printer's resolution
+        bar.empty()
+        st.error(f"❌ {e}")
+        return False
+    elapsed = time.perf_counter() - started
+    bar.empty()
+    st.session_state['label_file_path'] = str(path)
+    size_kb = os.path.getsize(path) / 1024
+    if cached:
+        st.session_state['label_stats'] = f"{total} etiquetas reaproveitadas do lote idêntico já gerado ({size_kb:.0f} KB)"
+    else:
+        st.session_state['label_stats'] = (f"{total} etiquetas em {elapsed:.1f}s "
+                                           f"({total / max(elapsed, 1e-6):.0f} etiquetas/s, {size_kb:.0f} KB)")
+    st.session_state['label_filename'] = f"{name}.{extension}"
+    st.session_state['label_mime'] = mime
+    # Thermal outputs are previewed in 1-bit, as the printer head will print them
+    mono = output != PDF_OUTPUT
+    if total == 1 or labels_per_page(plan) > 1:
+        st.session_state['generated_label'] = preview_png(render_preview(head, plan, mono), PREVIEW_WIDTH)
+        st.session_state.pop('batch_labels', None)
+    else:
+        st.session_state['batch_labels'] = [(item[0], preview_png(render_label(item, plan, mono=mono), BATCH_PREVIEW_WIDTH))
+                                            for item in head[:3]]
+        st.session_state['batch_count'] = total
+        st.session_state.pop('generated_label', None)
+    st.session_state.pop('pending_prints', None)
+    if printer_target:
+        try:
+            sent = send_file(path, printer_target)
+        except OSError as e:
+            st.error(f"Falha ao enviar para a impressora: {e}")
+        else:
+            if printed:
+                record_prints(printed(), printer_target)
+            st.success(f"✅ {sent / 1024:.1f} KB enviados para {printer_target}")
+            return True
+    if printed:
+        # Downloads are recorded only when confirmed ("Marcar como impressas")
+        st.session_state['pending_prints'] = printed()
+    return True
+
+def generate_query_labels(sql, params, name, plan, output, dpi=None, printer_target="") -> int:
+    """
+    Labels of every row of a LABEL_COLUMNS query, with the prices they show
+    kept for label_prints. Returns the label count.
+    """
+    # A cheap first pass counts and hashes the rows in one statement (one
+    # snapshot): the same batch (same items, prices, format and output) is
+    # served from the label cache instead of re-rendered
+    first = BatchKey(plan, output, dpi)
+    first_printed = [printed_values(row) for row in first.rows(iter_rows(sql, params))]
+    total = first.count
+    if total:
+        # The render pass hashes again what it draws: rows changed in between
+        # are rendered but not cached under the first pass's key
+        rendered, rendered_printed = BatchKey(plan, output, dpi), []
+
+        def render_rows():
+            for row in rendered.rows(iter_rows(sql, params)):
+                rendered_printed.append(printed_values(row))
+                yield row
+
+        # A cached file shows the first pass's rows; a re-rendered one, what it drew
+        def printed():
+            changed = rendered_printed and rendered.hexdigest() != first.hexdigest()
+            return rendered_printed if changed else first_printed
+
+        generate_labels(render_rows(), total, f"{name}_{total}", plan, output,
+                        first.hexdigest(), dpi, printer_target, rendered.hexdigest, printed)
+    return total
+
+st.divider()
+
+# Label templates and settings
+st.subheader("⚙️ Configurações de Etiqueta")
+
+col1, col2 = st.columns(2)
+
+with col1:
+    st.write("**Informações da loja (para etiquetas):**")
+    store_name = st.text_input("Nome da loja:", value="Brechó")
+    store_contact = st.text_input("Contato:", value="@brecho_bh")
+    
+    st.write("**Elementos na etiqueta:**")
+    include_qr = st.checkbox("QR Code", value=True)
+    qr_url = st.text_input("Link no QR (opcional):", value=QR_URL, placeholder="https://loja.com/p/{sku}",
+                           help="Vazio: o QR contém só o SKU. {sku} é trocado pelo SKU; "
+                                "links curtos em MAIÚSCULAS geram QR menores", disabled=not include_qr)
+    include_condition = st.checkbox("Estado do item", value=True)
+    include_original_price = st.checkbox("Preço original (quando com desconto)", value=True)
+    include_store_info = st.checkbox("Info da loja", value=False)
+
+with col2:
+    st.write("**Tamanhos de etiqueta disponíveis:**")
+    st.info("""
+    📏 **58x40mm:** Ideal para impressoras térmicas pequenas
+    📏 **70x50mm:** Padrão para a maioria das térmicas  
+    📏 **90x60mm:** Etiquetas grandes para itens especiais
+    📄 **A4 Grade:** Múltiplas etiquetas em folha A4
+    ✏️ **Personalizado:** Qualquer tamanho em mm (layout da 70x50 proporcional)
+    """)
+    
+    st.write("**Dicas de impressão:**")
+    st.markdown("""
+    - **Térmica:** Use papel térmico específico
+    - **A4:** Papel adesivo ou cole com fita
+    - **Qualidade:** 300 DPI recomendado
+    - **QR Code:** Teste leitura antes de colar
+    """)
+
+label_options = {
+    "qr": include_qr,
+    "condition": include_condition,
+    "original_price": include_original_price,
+    "store_info": include_store_info,
+    "store_name": store_name,
+    "store_contact": store_contact,
+    "qr_url": qr_url.strip(),
+}
+
 st.divider()
 
 # Label generation section
@@ -22,21 +207,37 @@ col1, col2 = st.columns([1, 2])
 
 with col1:
     # Label format selection
-    label_format = st.selectbox("Formato da etiqueta:", [
-        "58x40mm (Térmica pequena)",
-        "70x50mm (Térmica padrão)", 
-        "90x60mm (Etiqueta grande)",
-        "A4 - Grade 2x4 (8 etiquetas)",
-        "A4 - Grade 3x6 (18 etiquetas)"
-    ])
+    label_format = st.selectbox("Formato da etiqueta:", LABEL_FORMATS)
+    if label_format == CUSTOM_FORMAT:
+        c1, c2 = st.columns(2)
+        custom_width = c1.number_input("Largura (mm):", min_value=20.0, max_value=200.0, value=60.0, step=1.0)
+        custom_height = c2.number_input("Altura (mm):", min_value=15.0, max_value=200.0, value=40.0, step=1.0)
+        template = custom_template(custom_width, custom_height)
+    else:
+        template = TEMPLATES[label_format]
+    # Compiled once per run; every label of the batch only fills the plan
+    plan = render_plan(template, label_options)
+    
+    # PDF for any printer, or the thermal printer's own language (kilobytes per batch)
+    output = st.selectbox("Saída:", [PDF_OUTPUT, PNG_OUTPUT] + list(LANGUAGES),
+                          disabled=labels_per_page(plan) > 1,
+                          help="Folhas A4 sempre saem em PDF")
+    if labels_per_page(plan) > 1:
+        output = PDF_OUTPUT
+    dpi, printer_target = None, ""
+    if output in LANGUAGES:
+        dpi = st.selectbox("Resolução da impressora (DPI):", PRINTER_DPI)
+        printer_target = st.text_input("Enviar direto para (opcional):", placeholder="tcp://192.168.0.50:9100 ou /dev/usb/lp0",
+                                       help="Porta RAW (9100) da impressora de rede, ou dispositivo/arquivo local")
     
     # Single item or batch
-    generation_mode = st.radio("Modo:", ["Item único", "Lote de itens"])
+    generation_mode = st.radio("Modo:", ["Item único", "Lote de itens", "Etiquetas desatualizadas"],
+                               help="Desatualizadas: itens cujo preço ou desconto mudou desde a última impressão")
     
     if generation_mode == "Item único":
         # Get items for single label
-        _, items_data = fetchall("""
-            SELECT sku, category, brand, size, condition, list_price, markdown_stage
+        _, items_data = fetchall(f"""
+            SELECT {LABEL_COLUMNS}
             FROM items 
             WHERE active = 1 AND sold_at IS NULL
             ORDER BY listed_at DESC
@@ -53,10 +254,18 @@ with col1:
                 item_data = next((item for item in items_data if item[0] == selected_sku), None)
                 
                 if st.button("🏷️ Gerar Etiqueta", type="primary"):
-                    label_img = generate_single_label(item_data, label_format)
-                    if label_img:
-                        st.session_state['generated_label'] = label_img
-                        st.session_state['label_filename'] = f"etiqueta_{selected_sku}.png"
+                    generate_labels([item_data], 1, f"etiqueta_{selected_sku}", plan, output,
+                                    batch_key([item_data], plan, output, dpi), dpi, printer_target,
+                                    printed=lambda: [printed_values(item_data)])
+    
+    elif generation_mode == "Etiquetas desatualizadas":
+        # After a markdown run only the tags showing a wrong price are reprinted
+        stale_stage = st.selectbox("Etapa atual do item:", ["Todas"] + list(STAGE_NAMES),
+                                   format_func=lambda v: v if v == "Todas" else STAGE_NAMES[v])
+        sql, params = stale_query(None if stale_stage == "Todas" else stale_stage)
+        if st.button("🏷️ Reimprimir Etiquetas Desatualizadas", type="primary"):
+            if not generate_query_labels(sql, params, "etiquetas_desatualizadas", plan, output, dpi, printer_target):
+                st.info("Nenhuma etiqueta desatualizada: os preços impressos conferem com os atuais")
     
     else:  # Batch mode
         # Filters for batch generation
@@ -72,19 +281,15 @@ with col1:
             "Últimos 3 meses"
         ])
         
-        max_items = st.number_input("Máximo de etiquetas:", min_value=1, max_value=50, value=10)
+        max_items = st.number_input("Máximo de etiquetas:", min_value=1, value=10, step=10)
         
         if st.button("🏷️ Gerar Etiquetas em Lote", type="primary"):
             # Build query based on filters
-            query = """
-                SELECT sku, category, brand, size, condition, list_price, markdown_stage
-                FROM items 
-                WHERE active = 1 AND sold_at IS NULL
-            """
+            where = "WHERE active = 1 AND sold_at IS NULL"
             params = []
             
             if category_filter != "Todas":
-                query += " AND category = ?"
+                where += " AND category = ?"
                 params.append(category_filter)
             
             if days_filter != "Qualquer período":
@@ -93,349 +298,58 @@ with col1:
                     "Últimos 30 dias": 30,
                     "Últimos 3 meses": 90
                 }
-                query += " AND julianday('now') - julianday(listed_at) <= ?"
+                where += " AND julianday('now') - julianday(listed_at) <= ?"
                 params.append(days_map[days_filter])
             
-            query += f" ORDER BY listed_at DESC LIMIT {max_items}"
-            
-            _, batch_items = fetchall(query, params)
-            if batch_items:
-                if "A4" in label_format:
-                    # Generate A4 sheet with multiple labels
-                    labels_img = generate_a4_labels(batch_items, label_format)
-                    if labels_img:
-                        st.session_state['generated_label'] = labels_img
-                        st.session_state['label_filename'] = f"etiquetas_lote_{len(batch_items)}.png"
-                else:
-                    # Generate individual labels as ZIP
-                    st.info("💡 Para lotes grandes, recomendamos usar formato A4")
-                    if len(batch_items) <= 10:
-                        # Generate individual labels
-                        label_images = []
-                        for item in batch_items:
-                            label_img = generate_single_label(item, label_format)
-                            if label_img:
-                                label_images.append((item[0], label_img))
-                        
-                        if label_images:
-                            st.session_state['batch_labels'] = label_images
-            else:
+            # Rows are read from the database in chunks and the labels are written to a
+            # temp file as they go, so batch size is bounded by disk, not memory
+            batch_sql = f"""
+                SELECT {LABEL_COLUMNS}
+                FROM items {where}
+                ORDER BY listed_at DESC LIMIT ?
+            """
+            if not generate_query_labels(batch_sql, params + [int(max_items)], "etiquetas_lote",
+                                         plan, output, dpi, printer_target):
                 st.warning("Nenhum item encontrado com os filtros aplicados")
 
 with col2:
     # Preview and download section
     if 'generated_label' in st.session_state:
         st.write("**Preview da etiqueta:**")
-        st.image(st.session_state['generated_label'], width=300)
-        
-        # Convert to bytes for download
-        img_bytes = io.BytesIO()
-        st.session_state['generated_label'].save(img_bytes, format='PNG', dpi=(300, 300))
-        img_bytes.seek(0)
-        
-        st.download_button(
-            "📥 Baixar Etiqueta PNG",
-            img_bytes.getvalue(),
-            file_name=st.session_state.get('label_filename', 'etiqueta.png'),
-            mime="image/png"
-        )
+        st.image(st.session_state['generated_label'], width=PREVIEW_WIDTH)
     
     elif 'batch_labels' in st.session_state:
-        st.write(f"**{len(st.session_state['batch_labels'])} etiquetas geradas:**")
+        batch_count = st.session_state.get('batch_count', len(st.session_state['batch_labels']))
+        st.write(f"**{batch_count} etiquetas geradas:**")
         
         # Show first few as preview
-        for i, (sku, label_img) in enumerate(st.session_state['batch_labels'][:3]):
+        for i, (sku, label_img) in enumerate(st.session_state['batch_labels']):
             st.write(f"Etiqueta {i+1}: {sku}")
-            st.image(label_img, width=200)
-        
-        if len(st.session_state['batch_labels']) > 3:
-            st.write(f"... e mais {len(st.session_state['batch_labels']) - 3} etiquetas")
+            st.image(label_img, width=BATCH_PREVIEW_WIDTH)
         
-        # Individual downloads
-        for sku, label_img in st.session_state['batch_labels']:
-            img_bytes = io.BytesIO()
-            label_img.save(img_bytes, format='PNG', dpi=(300, 300))
-            img_bytes.seek(0)
-            
-            st.download_button(
-                f"📥 {sku}",
-                img_bytes.getvalue(),
-                file_name=f"etiqueta_{sku}.png",
-                mime="image/png",
-                key=f"download_{sku}"
-            )
-
-def generate_single_label(item_data, label_format):
-    """Generate a single item label"""
-    if not item_data:
-        return None
-    
-    sku, category, brand, size, condition, list_price, markdown_stage = item_data
-    current_price = compute_markdown_price(list_price, markdown_stage)
-    
-    # Label dimensions (in pixels at 300 DPI)
-    dimensions = {
-        "58x40mm (Térmica pequena)": (689, 472),  # 58x40mm at 300 DPI
-        "70x50mm (Térmica padrão)": (827, 591),   # 70x50mm at 300 DPI  
-        "90x60mm (Etiqueta grande)": (1063, 709)  # 90x60mm at 300 DPI
-    }
-    
-    if label_format not in dimensions:
-        return None
-    
-    width, height = dimensions[label_format]
-    
-    # Create image
-    img = Image.new('RGB', (width, height), 'white')
-    draw = ImageDraw.Draw(img)
-    
-    # Try to load fonts (fallback to default if not available)
-    try:
-        if "pequena" in label_format:
-            font_large = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 20)
-            font_medium = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 16)
-            font_small = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 12)
-        else:
-            font_large = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 28)
-            font_medium = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 20)
-            font_small = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 16)
-    except:
-        # Fallback to default font
-        font_large = ImageFont.load_default()
-        font_medium = ImageFont.load_default()
-        font_small = ImageFont.load_default()
-    
-    # Generate QR code
-    qr = qrcode.QRCode(version=1, box_size=3, border=1)
-    qr.add_data(sku)
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Resize QR code based on label size
-    if "pequena" in label_format:
-        qr_size = 80
-    else:
-        qr_size = 120
-    
-    qr_img = qr_img.resize((qr_size, qr_size))
-    
-    # Layout elements
-    margin = 10
-    
-    # Position QR code (left side)
-    qr_x = margin
-    qr_y = (height - qr_size) // 2
-    img.paste(qr_img, (qr_x, qr_y))
-    
-    # Text area (right of QR code)
-    text_x = qr_x + qr_size + margin
-    text_width = width - text_x - margin
-    
-    # Draw text elements
-    y_pos = margin
-    
-    # SKU
-    draw.text((text_x, y_pos), sku, fill="black", font=font_medium)
-    y_pos += 30 if "pequena" not in label_format else 25
-    
-    # Category and brand
-    item_desc = f"{category}"
-    if brand:
-        item_desc += f" {brand}"
-    if size:
-        item_desc += f" {size}"
-    
-    # Wrap text if too long
-    if len(item_desc) > 15 and "pequena" in label_format:
-        # Split into two lines for small labels
-        words = item_desc.split()
-        line1 = " ".join(words[:2])
-        line2 = " ".join(words[2:])
-        draw.text((text_x, y_pos), line1, fill="black", font=font_small)
-        y_pos += 20
-        if line2:
-            draw.text((text_x, y_pos), line2, fill="black", font=font_small)
-            y_pos += 20
-    else:
-        draw.text((text_x, y_pos), item_desc, fill="black", font=font_small)
-        y_pos += 25 if "pequena" not in label_format else 20
-    
-    # Condition
-    draw.text((text_x, y_pos), f"Estado: {condition}", fill="black", font=font_small)
-    y_pos += 25 if "pequena" not in label_format else 20
-    
-    # Price
-    if markdown_stage > 0:
-        # Show original price crossed out
-        price_text = f"R$ {current_price:.2f}"
-        original_text = f"(R$ {list_price:.2f})"
-        draw.text((text_x, y_pos), price_text, fill="red", font=font_large)
-        y_pos += 30 if "pequena" not in label_format else 25
-        draw.text((text_x, y_pos), original_text, fill="gray", font=font_small)
-        
-        # Draw line through original price
-        bbox = draw.textbbox((text_x, y_pos), original_text, font=font_small)
-        draw.line([(bbox[0], bbox[1] + 8), (bbox[2], bbox[1] + 8)], fill="gray", width=1)
-    else:
-        price_text = f"R$ {current_price:.2f}"
-        draw.text((text_x, y_pos), price_text, fill="black", font=font_large)
-    
-    return img
-
-def generate_a4_labels(items_data, label_format):
-    """Generate A4 sheet with multiple labels"""
-    # A4 dimensions at 300 DPI
-    a4_width, a4_height = 2480, 3508
-    
-    # Grid configuration
-    if "2x4" in label_format:
-        cols, rows = 2, 4
-        label_width = (a4_width - 3 * 40) // 2  # 40px margins
-        label_height = (a4_height - 5 * 40) // 4
-    else:  # 3x6
-        cols, rows = 3, 6
-        label_width = (a4_width - 4 * 30) // 3  # 30px margins
-        label_height = (a4_height - 7 * 30) // 6
-    
-    # Create A4 image
-    a4_img = Image.new('RGB', (a4_width, a4_height), 'white')
-    
-    # Generate individual labels and place them
-    for i, item_data in enumerate(items_data):
-        if i >= cols * rows:
-            break  # Can't fit more labels
-        
-        # Generate individual label (simplified for A4)
-        label_img = generate_a4_single_label(item_data, label_width, label_height)
-        if label_img:
-            # Calculate position
-            col = i % cols
-            row = i // cols
-            
-            margin_x = 40 if "2x4" in label_format else 30
-            margin_y = 40 if "2x4" in label_format else 30
-            
-            x = margin_x + col * (label_width + margin_x)
-            y = margin_y + row * (label_height + margin_y)
-            
-            a4_img.paste(label_img, (x, y))
-    
-    return a4_img
-
-def generate_a4_single_label(item_data, width, height):
-    """Generate a single label optimized for A4 printing"""
-    sku, category, brand, size, condition, list_price, markdown_stage = item_data
-    current_price = compute_markdown_price(list_price, markdown_stage)
-    
-    # Create label image
-    img = Image.new('RGB', (width, height), 'white')
-    draw = ImageDraw.Draw(img)
-    
-    # Draw border
-    draw.rectangle([(0, 0), (width-1, height-1)], outline="black", width=2)
-    
-    # Fonts for A4
-    try:
-        font_large = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 24)
-        font_medium = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 18)
-        font_small = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 14)
-    except:
-        font_large = ImageFont.load_default()
-        font_medium = ImageFont.load_default()  
-        font_small = ImageFont.load_default()
-    
-    # Generate small QR code
-    qr = qrcode.QRCode(version=1, box_size=2, border=1)
-    qr.add_data(sku)
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    qr_img = qr_img.resize((60, 60))
-    
-    # Layout
-    margin = 8
-    
-    # QR code (top right)
-    qr_x = width - 60 - margin
-    qr_y = margin
-    img.paste(qr_img, (qr_x, qr_y))
-    
-    # Text content
-    y_pos = margin
-    
-    # SKU (top left)
-    draw.text((margin, y_pos), sku, fill="black", font=font_medium)
-    y_pos += 25
-    
-    # Category, brand, size
-    item_desc = f"{category}"
-    if brand:
-        item_desc += f" {brand}"
-    if size:
-        item_desc += f" {size}"
-    
-    draw.text((margin, y_pos), item_desc, fill="black", font=font_small)
-    y_pos += 20
-    
-    # Condition
-    draw.text((margin, y_pos), f"Estado: {condition}", fill="black", font=font_small)
-    y_pos += 20
-    
-    # Price (bottom, centered)
-    price_text = f"R$ {current_price:.2f}"
-    bbox = draw.textbbox((0, 0), price_text, font=font_large)
-    price_width = bbox[2] - bbox[0]
-    price_x = (width - price_width) // 2
-    price_y = height - 35
-    
-    if markdown_stage > 0:
-        draw.text((price_x, price_y), price_text, fill="red", font=font_large)
-        # Original price
-        orig_text = f"(R$ {list_price:.2f})"
-        orig_bbox = draw.textbbox((0, 0), orig_text, font=font_small)
-        orig_width = orig_bbox[2] - orig_bbox[0]
-        orig_x = (width - orig_width) // 2
-        draw.text((orig_x, price_y - 18), orig_text, fill="gray", font=font_small)
-        # Strike through
-        draw.line([(orig_x, price_y - 10), (orig_x + orig_width, price_y - 10)], fill="gray", width=1)
-    else:
-        draw.text((price_x, price_y), price_text, fill="black", font=font_large)
-    
-    return img
-
-st.divider()
-
-# Label templates and settings
-st.subheader("⚙️ Configurações de Etiqueta")
-
-col1, col2 = st.columns(2)
-
-with col1:
-    st.write("**Informações da loja (para etiquetas):**")
-    store_name = st.text_input("Nome da loja:", value="Brechó")
-    store_contact = st.text_input("Contato:", value="@brecho_bh")
-    
-    st.write("**Elementos na etiqueta:**")
-    include_qr = st.checkbox("QR Code", value=True)
-    include_condition = st.checkbox("Estado do item", value=True)
-    include_original_price = st.checkbox("Preço original (quando com desconto)", value=True)
-    include_store_info = st.checkbox("Info da loja", value=False)
-
-with col2:
-    st.write("**Tamanhos de etiqueta disponíveis:**")
-    st.info("""
-    📏 **58x40mm:** Ideal para impressoras térmicas pequenas
-    📏 **70x50mm:** Padrão para a maioria das térmicas  
-    📏 **90x60mm:** Etiquetas grandes para itens especiais
-    📄 **A4 Grade:** Múltiplas etiquetas em folha A4
-    """)
-    
-    st.write("**Dicas de impressão:**")
-    st.markdown("""
-    - **Térmica:** Use papel térmico específico
-    - **A4:** Papel adesivo ou cole com fita
-    - **Qualidade:** 300 DPI recomendado
-    - **QR Code:** Teste leitura antes de colar
-    """)
+        if batch_count > 3:
+            st.write(f"... e mais {batch_count - 3} etiquetas")
+    
+    label_file_path = st.session_state.get('label_file_path')
+    if label_file_path and os.path.exists(label_file_path):
+        if st.session_state.get('label_stats'):
+            st.caption(st.session_state['label_stats'])
+        # One download for the whole batch; the file is only read when the button is clicked
+        def read_label_file(path=label_file_path):
+            with open(path, "rb") as f:
+                return f.read()
+        st.download_button(
+            "📥 Baixar Etiquetas",
+            read_label_file,
+            file_name=st.session_state.get('label_filename', 'etiquetas.pdf'),
+            mime=st.session_state.get('label_mime', 'application/pdf'),
+            on_click="ignore"
+        )
+        if st.session_state.get('pending_prints'):
+            # Stale-label tracking needs to know the labels really went on the pieces
+            if st.button("✅ Marcar como impressas"):
+                recorded = record_prints(st.session_state.pop('pending_prints'))
+                st.success(f"✅ {recorded} etiquetas registradas como impressas")
 
 # Bulk label operations
 st.divider()
@@ -449,33 +363,25 @@ with col1:
         # Find items that might need labels (recently added, no photos/notes about labels)
         st.info("Funcionalidade em desenvolvimento")
     
-    st.write("**Etiquetas de desconto:**")
-    discount_stage = st.selectbox("Gerar para etapa:", [
-        "1º desconto (-10%)",
-        "2º desconto (-25%)", 
-        "3º desconto (-40%)"
-    ])
-    if st.button("🏷️ Gerar etiquetas com desconto"):
-        stage_map = {"1º desconto (-10%)": 1, "2º desconto (-25%)": 2, "3º desconto (-40%)": 3}
-        stage = stage_map[discount_stage]
-        
-        _, discount_items = fetchall("""
-            SELECT sku, category, brand, size, condition, list_price, markdown_stage
-            FROM items 
-            WHERE active = 1 AND sold_at IS NULL AND markdown_stage = ?
-            ORDER BY listed_at DESC
-            LIMIT 20
-        """, (stage,))
-        
-        if discount_items:
-            st.success(f"Encontrados {len(discount_items)} itens no {discount_stage}")
-            # Generate batch labels would go here
-        else:
-            st.info(f"Nenhum item encontrado no {discount_stage}")
+    st.write("**Etiquetas desatualizadas:**")
+    # Printed price (label_prints) vs today's, e.g. after the markdown run in Automação
+    _, stale_rows = stale_by_stage()
+    if stale_rows:
+        for stage, qty in stale_rows:
+            st.write(f"• {qty} etiquetas a trocar — {STAGE_NAMES.get(stage, stage)}")
+        st.caption("Use o modo \"Etiquetas desatualizadas\" acima para reimprimir só essas peças")
+    else:
+        st.success("✅ Nenhuma etiqueta impressa com preço desatualizado")
 
 with col2:
     st.write("**Histórico de impressão:**")
-    st.info("Em desenvolvimento: rastreamento de etiquetas impressas")
+    _, history = print_history()
+    if history:
+        df_history = pd.DataFrame(history, columns=['Impresso em', 'Etiquetas', 'Reimpressões', 'Impressora'])
+        df_history['Impressora'] = df_history['Impressora'].replace("", "arquivo baixado")
+        st.dataframe(df_history, use_container_width=True, hide_index=True)
+    else:
+        st.info("Nenhuma etiqueta impressa ainda")
     
     st.write("**Configurações da impressora:**")
     printer_type = st.selectbox("Tipo de impressora:", [
@@ -491,7 +397,9 @@ with col2:
 
 # Clear session state button
 if st.button("🗑️ Limpar etiquetas geradas"):
-    for key in ['generated_label', 'batch_labels', 'label_filename']:
+    # Files stay in the shared label cache until they expire (labels.LABEL_CACHE_MAX_AGE)
+    for key in ['label_file_path', 'generated_label', 'batch_labels', 'batch_count', 'label_filename', 'label_mime', 'label_stats',
+                'pending_prints']:
         if key in st.session_state:
             del st.session_state[key]
     st.success("✅ Cache de etiquetas limpo")
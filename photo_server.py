@@ -0,0 +1,100 @@
+\
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from images import BLOBS_DIR, variant_path
+
+# Blob files are named after their content hash, so a URL never changes meaning:
+# browsers may keep them forever. (Streamlit's own static route sends no-cache.)
+# Local only by default; BRECHO_PHOTO_HOST=0.0.0.0 opts in to serving the whole LAN
+PHOTO_HOST = os.environ.get("BRECHO_PHOTO_HOST", "127.0.0.1")
+PHOTO_PORT = int(os.environ.get("BRECHO_PHOTO_PORT", "8502"))
+# Public base URL when the server sits behind a proxy, e.g. https://fotos.brecho.com.br
+PHOTO_BASE_URL = os.environ.get("BRECHO_PHOTO_URL", "")
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+LOOPBACK_HOSTS = {"127.0.0.1", "localhost", "::1", "[::1]"}
+# Stored blob paths (photos/blobs/<h[:2]>/...), relative or absolute, map to URLs by
+# stripping one of these prefixes: no filesystem lookups while a gallery renders
+BLOB_PREFIXES = (BLOBS_DIR.as_posix() + "/", BLOBS_DIR.resolve().as_posix() + "/")
+
+_server = None
+_lock = threading.Lock()
+
+class BlobHandler(SimpleHTTPRequestHandler):
+    """Read-only handler for photos/blobs: no directory listings, immutable caching."""
+
+    def list_directory(self, path):
+        self.send_error(404)
+        return None
+
+    def send_head(self):
+        # File names are content hashes, so the name is a strong ETag; only for files that exist
+        etag = f'"{Path(self.path.split("?")[0]).stem}"'
+        if self.headers.get("If-None-Match") == etag and os.path.isfile(self.translate_path(self.path)):
+            self.send_response(304)
+            self.end_headers()
+            return None
+        return super().send_head()
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        # Caching headers on hits only: a 404 must not be kept forever
+        if code in (200, 304):
+            self.send_header("ETag", f'"{Path(self.path.split("?")[0]).stem}"')
+            self.send_header("Cache-Control", CACHE_CONTROL)
+            self.send_header("Access-Control-Allow-Origin", "*")
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server() -> bool:
+    """Start the blob file server once per process. False if the port is unavailable."""
+    global _server
+    with _lock:
+        if _server is not None:
+            return True
+        BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+        handler = partial(BlobHandler, directory=str(BLOBS_DIR.resolve()))
+        try:
+            _server = ThreadingHTTPServer((PHOTO_HOST, PHOTO_PORT), handler)
+        except OSError:
+            # Usually another app process already serves the same folder on this port
+            return False
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="photo-server", daemon=True).start()
+        return True
+
+def base_url() -> str:
+    """
+    BRECHO_PHOTO_URL, or the host the browser used to reach Streamlit on
+    PHOTO_PORT. ValueError when the server only listens locally and the browser
+    is on another machine (callers fall back to Streamlit's own images).
+    """
+    if PHOTO_BASE_URL:
+        return PHOTO_BASE_URL.rstrip("/")
+    host = "localhost"
+    try:
+        import streamlit as st
+        headers = getattr(st, "context", None) and st.context.headers
+        if headers and headers.get("Host"):
+            host = headers["Host"].rsplit(":", 1)[0]
+    except Exception:
+        pass
+    if PHOTO_HOST in LOOPBACK_HOSTS and host not in LOOPBACK_HOSTS:
+        raise ValueError("servidor de fotos disponível só neste computador")
+    return f"http://{host}:{PHOTO_PORT}"
+
+def photo_url(photo_path, size: str = "card") -> str:
+    """Hash URL of a blob file (or one of its profiles) on the photo server. ValueError outside the blob store."""
+    path = variant_path(photo_path, size).as_posix()
+    for prefix in BLOB_PREFIXES:
+        if path.startswith(prefix):
+            return f"{base_url()}/{path[len(prefix):]}"
+    raise ValueError(f"{photo_path} fora de {BLOBS_DIR}")
+
+def img_tag(photo_path, size: str = "card", alt: str = "") -> str:
+    """<img> for st.markdown(unsafe_allow_html=True): cached by the browser, loaded lazily."""
+    return (f'<img src="{photo_url(photo_path, size)}" alt="{alt}" loading="lazy" '
+            f'style="width:100%;border-radius:4px">')
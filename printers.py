@@ -0,0 +1,247 @@
+\
+"""
+Printer-native label output: the render plans of labels.py drawn as ZPL
+(Zebra and compatibles), TSPL (TSC, Argox, Elgin) or ESC/POS (generic
+thermal printers, page mode) commands, with the printer's own fonts and QR
+generator. A label is a few hundred bytes instead of a 300-DPI image.
+
+Jobs go to a file or device path (/dev/usb/lp0, a file for testing) or to a
+network printer's raw port (tcp://192.168.0.50:9100).
+"""
+import socket
+from contextlib import contextmanager
+from reportlab.pdfbase import pdfmetrics
+from labels import DPI, MM_PER_INCH, PROGRESS_EVERY, fill_label, labels_per_page
+from qr_codes import LABEL_BORDER, qr_matrix
+
+# Most label printers are 203 DPI (8 dots/mm); 300 DPI models exist for ZPL/TSPL
+PRINTER_DPI = (203, 300)
+# Printer dots per QR module: below 3 phone cameras stop reading the code; 10 is the
+# largest magnification ZPL and TSPL accept
+MIN_QR_MODULE_DOTS = 3
+MAX_QR_MODULE_DOTS = 10
+SOCKET_TIMEOUT = 10
+RAW_PORT = 9100
+
+class CommandSurface:
+    """
+    Base for printer-language surfaces: takes the plan's 300-DPI pixel
+    coordinates, emits printer dots. Text is measured with the Helvetica
+    metrics, close to the printers' built-in sans fonts.
+    """
+    encoding = "utf-8"
+
+    def __init__(self, plan, dpi: int = PRINTER_DPI[0]):
+        self.dpi = dpi
+        self.width, self.height = plan["label"]
+        self.origin = (0, 0)
+        self.commands = []
+
+    def dots(self, v) -> int:
+        return round(v * self.dpi / DPI)
+
+    def _xy(self, x, y):
+        return self.dots(self.origin[0] + x), self.dots(self.origin[1] + y)
+
+    def _qr_layout(self, x, y, size, data):
+        """
+        (x, y, dots per module) of the printer-drawn symbol: whole dots per
+        module, centred in the box like RasterSurface.qr. The printers add no
+        quiet zone, so the symbol starts LABEL_BORDER modules in.
+        """
+        modules = len(qr_matrix(data))
+        side = self.dots(size)
+        magnification = min(MAX_QR_MODULE_DOTS, side // modules)
+        if magnification < MIN_QR_MODULE_DOTS:
+            raise ValueError(f"O QR ({modules} módulos) não cabe em {side} pontos com pelo menos "
+                             f"{MIN_QR_MODULE_DOTS} pontos por módulo a {self.dpi} DPI; use uma etiqueta maior, "
+                             f"300 DPI ou um link mais curto.")
+        x, y = self._xy(x, y)
+        offset = (side - modules * magnification) // 2 + LABEL_BORDER * magnification
+        return x + offset, y + offset, magnification
+
+    def text_width(self, text, size, weight="regular") -> float:
+        return pdfmetrics.stringWidth(text, "Helvetica-Bold" if weight == "bold" else "Helvetica", size)
+
+    @classmethod
+    def job_header(cls, plan, dpi) -> bytes:
+        return b""
+
+    def finish(self) -> bytes:
+        return "\n".join(self.commands).encode(self.encoding, "replace") + b"\n"
+
+class ZplSurface(CommandSurface):
+    """ZPL II: one ^XA ... ^XZ format per label, scalable font 0, ^BQ QR."""
+    # ^BQ draws the symbol this many dots below its ^FO origin
+    QR_TOP_OFFSET = 10
+
+    def __init__(self, plan, dpi: int = PRINTER_DPI[0]):
+        super().__init__(plan, dpi)
+        self.commands += ["^XA", "^CI28", f"^PW{self.dots(self.width)}", f"^LL{self.dots(self.height)}", "^LH0,0"]
+
+    @staticmethod
+    def _field(text) -> str:
+        # ^ and ~ start commands inside field data
+        return str(text).replace("^", " ").replace("~", " ")
+
+    def text(self, x, y, text, size, fill="black", weight="regular"):
+        x, y = self._xy(x, y)
+        h = self.dots(size)
+        self.commands.append(f"^FO{x},{y}^A0N,{h},{h}^FD{self._field(text)}^FS")
+
+    def line(self, x1, y1, x2, y2, fill="black", width=1):
+        (x1, y1), (x2, y2) = self._xy(x1, y1), self._xy(x2, y2)
+        t = max(1, self.dots(width))
+        self.commands.append(f"^FO{min(x1, x2)},{min(y1, y2)}^GB{max(abs(x2 - x1), t)},{max(abs(y2 - y1), t)},{t}^FS")
+
+    def border(self, width, height, line_width=2):
+        x, y = self._xy(0, 0)
+        self.commands.append(f"^FO{x},{y}^GB{self.dots(width)},{self.dots(height)},{max(1, self.dots(line_width))}^FS")
+
+    def qr(self, x, y, size, data):
+        x, y, magnification = self._qr_layout(x, y, size, data)
+        y = max(0, y - self.QR_TOP_OFFSET)
+        self.commands.append(f"^FO{x},{y}^BQN,2,{magnification}^FDMA,{self._field(data)}^FS")
+
+    def finish(self) -> bytes:
+        self.commands += ["^PQ1", "^XZ"]
+        return super().finish()
+
+class TsplSurface(CommandSurface):
+    """TSPL/TSPL2: SIZE/GAP once per job, then CLS ... PRINT per label."""
+
+    @classmethod
+    def job_header(cls, plan, dpi) -> bytes:
+        w, h = (v / DPI * MM_PER_INCH for v in plan["label"])
+        return f"SIZE {w:.1f} mm,{h:.1f} mm\nGAP 2 mm,0 mm\nDIRECTION 1\nCODEPAGE UTF-8\n".encode()
+
+    def __init__(self, plan, dpi: int = PRINTER_DPI[0]):
+        super().__init__(plan, dpi)
+        self.commands.append("CLS")
+
+    @staticmethod
+    def _string(text) -> str:
+        return '"' + str(text).replace('"', '\\["]') + '"'
+
+    def text(self, x, y, text, size, fill="black", weight="regular"):
+        x, y = self._xy(x, y)
+        # Font "0" is the scalable font; multipliers are its size in points
+        pt = max(1, round(size * 72 / DPI))
+        self.commands.append(f'TEXT {x},{y},"0",0,{pt},{pt},{self._string(text)}')
+
+    def line(self, x1, y1, x2, y2, fill="black", width=1):
+        (x1, y1), (x2, y2) = self._xy(x1, y1), self._xy(x2, y2)
+        t = max(1, self.dots(width))
+        self.commands.append(f"BAR {min(x1, x2)},{min(y1, y2)},{max(abs(x2 - x1), t)},{max(abs(y2 - y1), t)}")
+
+    def border(self, width, height, line_width=2):
+        x, y = self._xy(0, 0)
+        x2, y2 = self._xy(width, height)
+        self.commands.append(f"BOX {x},{y},{x2},{y2},{max(1, self.dots(line_width))}")
+
+    def qr(self, x, y, size, data):
+        x, y, magnification = self._qr_layout(x, y, size, data)
+        self.commands.append(f"QRCODE {x},{y},M,{magnification},A,0,{self._string(data)}")
+
+    def finish(self) -> bytes:
+        self.commands.append("PRINT 1,1")
+        return super().finish()
+
+class EscPosSurface(CommandSurface):
+    """
+    ESC/POS page mode: absolute positions, built-in 12x24 font scaled by whole
+    multiples, GS ( k QR. No line drawing, so borders and strikethrough are left
+    out (the original price keeps its parentheses).
+    """
+    encoding = "cp860"  # ESC t 3, Portuguese
+    FONT_HEIGHT = 24
+
+    @classmethod
+    def job_header(cls, plan, dpi) -> bytes:
+        return b"\x1b@\x1bt\x03"
+
+    def __init__(self, plan, dpi: int = PRINTER_DPI[0]):
+        super().__init__(plan, dpi)
+        w, h = self.dots(self.width), self.dots(self.height)
+        self.data = bytearray(b"\x1bL" + b"\x1bW" + self._u16(0, 0, w, h) + b"\x1bT\x00")
+
+    @staticmethod
+    def _u16(*values) -> bytes:
+        return b"".join(int(v).to_bytes(2, "little") for v in values)
+
+    def _at(self, x, baseline):
+        self.data += b"\x1b$" + self._u16(x) + b"\x1d$" + self._u16(baseline)
+
+    def text(self, x, y, text, size, fill="black", weight="regular"):
+        x, y = self._xy(x, y)
+        n = max(1, min(8, round(self.dots(size) / self.FONT_HEIGHT)))
+        # Page mode positions text by its baseline
+        self._at(x, y + n * self.FONT_HEIGHT)
+        self.data += b"\x1b!" + (b"\x08" if weight == "bold" else b"\x00")
+        self.data += b"\x1d!" + bytes([(n - 1) << 4 | (n - 1)])
+        self.data += str(text).encode(self.encoding, "replace")
+
+    def line(self, *args, **kwargs):
+        pass
+
+    def border(self, *args, **kwargs):
+        pass
+
+    def qr(self, x, y, size, data):
+        x, y, magnification = self._qr_layout(x, y, size, data)
+        payload = str(data).encode(self.encoding, "replace")
+        # Page mode places the symbol on its bottom edge
+        self._at(x, y + (len(qr_matrix(data)) - 2 * LABEL_BORDER) * magnification)
+        self.data += b"\x1d(k\x04\x001A2\x00"                                       # model 2
+        self.data += b"\x1d(k\x03\x001C" + bytes([magnification])                    # module size
+        self.data += b"\x1d(k\x03\x001E1"                                           # ECC M
+        self.data += b"\x1d(k" + self._u16(len(payload) + 3) + b"1P0" + payload      # store
+        self.data += b"\x1d(k\x03\x001Q0"                                           # print
+
+    def finish(self) -> bytes:
+        # FF prints the page and returns to standard mode
+        return bytes(self.data + b"\x1d!\x00\x0c")
+
+# Page option -> (surface, file extension)
+LANGUAGES = {
+    "ZPL (Zebra)": (ZplSurface, "zpl"),
+    "TSPL (TSC/Argox/Elgin)": (TsplSurface, "prn"),
+    "ESC/POS": (EscPosSurface, "bin"),
+}
+
+def write_printer_job(items, plan, language: str, out, dpi: int = PRINTER_DPI[0],
+                      total: int = None, progress=None) -> int:
+    """Write the command stream for every item to a binary file object. Returns the label count."""
+    if labels_per_page(plan) > 1:
+        raise ValueError("Folhas A4 não são suportadas por impressoras térmicas; escolha um formato de etiqueta.")
+    surface_class = LANGUAGES[language][0]
+    out.write(surface_class.job_header(plan, dpi))
+    n = 0
+    for n, item in enumerate(items, 1):
+        surface = surface_class(plan, dpi)
+        fill_label(surface, plan, item)
+        out.write(surface.finish())
+        if progress and (n % PROGRESS_EVERY == 0 or n == total):
+            progress(n, total)
+    return n
+
+@contextmanager
+def open_sink(target: str):
+    """Binary writer for a printer: tcp://host[:port] (raw port 9100) or a file/device path."""
+    if target.startswith("tcp://"):
+        host, _, port = target[len("tcp://"):].partition(":")
+        with socket.create_connection((host, int(port or RAW_PORT)), timeout=SOCKET_TIMEOUT) as sock:
+            with sock.makefile("wb") as out:
+                yield out
+    else:
+        with open(target, "wb") as out:
+            yield out
+
+def send_file(path, target: str, chunk_size: int = 64 * 1024) -> int:
+    """Copy a generated job to a printer sink. Returns the bytes sent."""
+    sent = 0
+    with open(path, "rb") as src, open_sink(target) as out:
+        while chunk := src.read(chunk_size):
+            out.write(chunk)
+            sent += len(chunk)
+    return sent